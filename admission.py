@@ -0,0 +1,85 @@
+import os
+import secrets
+import time
+
+import processes
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS usage (
+    user_id TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS slots (
+    id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    started REAL NOT NULL
+);
+'''
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+def take(conn, key, amount, rate, burst, debt=False):
+    # Returns 0 when the tokens were taken. Otherwise returns the seconds
+    # until they would be available. With debt=True the tokens are taken
+    # anyway and the caller is expected to wait that long, which is how
+    # byte streams are throttled.
+    now = time.time()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row['tokens'] + (now - row['updated']) * rate)
+        if tokens >= amount or debt:
+            tokens -= amount
+            wait = max(0.0, -tokens / rate)
+        else:
+            wait = (amount - tokens) / rate
+        conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                     (key, tokens, now))
+    return wait
+
+
+def acquire_slot(conn, limit, ttl):
+    now = time.time()
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM slots WHERE started < ?', (now - ttl,))
+        if conn.execute('SELECT COUNT(*) FROM slots').fetchone()[0] >= limit:
+            dead = [(row['id'],) for row in conn.execute('SELECT id, pid FROM slots') if not processes.pid_alive(row['pid'])]
+            conn.executemany('DELETE FROM slots WHERE id = ?', dead)
+            if not dead:
+                return None
+        slot = secrets.token_hex(8)
+        conn.execute('INSERT INTO slots (id, pid, started) VALUES (?, ?, ?)', (slot, os.getpid(), now))
+    return slot
+
+
+def release_slot(conn, slot):
+    with conn:
+        conn.execute('DELETE FROM slots WHERE id = ?', (slot,))
+
+
+def get_usage(conn, user_id):
+    row = conn.execute('SELECT bytes FROM usage WHERE user_id = ?', (user_id,)).fetchone()
+    return row['bytes'] if row else 0
+
+
+def add_usage(conn, user_id, delta):
+    with conn:
+        conn.execute(
+            'INSERT INTO usage (user_id, bytes) VALUES (?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET bytes = bytes + excluded.bytes',
+            (user_id, delta))
+
+
+def reset_usage(conn, totals):
+    with conn:
+        conn.execute('DELETE FROM usage')
+        conn.executemany('INSERT INTO usage (user_id, bytes) VALUES (?, ?)', totals)
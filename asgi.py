@@ -0,0 +1,317 @@
+"""asyncio serving mode for the upload and streaming routes.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+GET/HEAD on /videos/<user_id>/<filename>, /blobs/<sha256>/<filename> and
+/hls/<user_id>/<filename>/<segment>, and PUT on /videos/<user_id>/<filename>,
+are handled here without holding a thread per connection. Every other route
+is passed to the Flask app through asgiref's WSGI adapter.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import time
+from http import HTTPStatus
+
+from werkzeug.datastructures import Headers
+from werkzeug.exceptions import HTTPException, NotFound
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+import blobs
+import jobs
+import metrics
+import resumable
+import server
+import serving
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    WsgiToAsgi = None
+
+flask_app = WsgiToAsgi(server.app) if WsgiToAsgi is not None else None
+
+
+def request_headers(scope):
+    return Headers([(key.decode('latin-1'), value.decode('latin-1')) for key, value in scope['headers']])
+
+
+def encode_headers(headers):
+    return [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+
+
+async def respond(send, status, body=b'', headers=None, content_type='text/plain; charset=utf-8'):
+    if not body and status >= 400:
+        body = HTTPStatus(status).phrase.encode('ascii')
+    headers = dict(headers or {})
+    headers.setdefault('Content-Type', content_type)
+    headers['Content-Length'] = str(len(body))
+    await send({'type': 'http.response.start', 'status': status, 'headers': encode_headers(headers)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def respond_error(send, e):
+    headers = {key: value for key, value in e.get_headers() if key == 'Retry-After'}
+    await respond(send, e.code, e.description.encode('utf-8'), headers)
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+def read_chunk(fd, size, offset):
+    started = time.perf_counter()
+    chunk = os.pread(fd, size, offset)
+    metrics.record_disk_read(len(chunk), time.perf_counter() - started)
+    return chunk
+
+
+async def send_ranges(send, plan):
+    loop = asyncio.get_running_loop()
+    fd = plan.fp.fileno()
+    for i, (start, stop) in enumerate(plan.ranges):
+        if plan.parts:
+            await send({'type': 'http.response.body', 'body': plan.parts[i], 'more_body': True})
+        while start < stop:
+            chunk = await loop.run_in_executor(None, read_chunk, fd, min(serving.CHUNK_SIZE, stop - start), start)
+            if not chunk:
+                break
+            start += len(chunk)
+            # send() only returns once the server has room in its write
+            # buffer, so a slow viewer holds at most one chunk in memory.
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    if plan.parts:
+        await send({'type': 'http.response.body', 'body': plan.parts[-1], 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+def in_app_context(func, *args):
+    with server.app.app_context():
+        return func(*args)
+
+
+def resolve_video(user_id, filename):
+    video = server.resolve_video(user_id, filename)
+    if video is None:
+        return None
+    path = blobs.blob_path(server.app.config['BLOB_FOLDER'], video['sha256'])
+    return path, mimetypes.guess_type(filename)[0], video['sha256'], 'no-cache'
+
+
+def resolve_blob(sha256, filename):
+    if not re.fullmatch('[0-9a-f]{64}', sha256):
+        return None
+    path = blobs.blob_path(server.app.config['BLOB_FOLDER'], sha256)
+    return path, mimetypes.guess_type(filename)[0], sha256, server.app.config['BLOB_CACHE_CONTROL']
+
+
+def resolve_hls(user_id, filename, segment):
+    video = server.resolve_video(user_id, filename)
+    path = video and safe_join(jobs.hls_folder(server.app.config['HLS_FOLDER'], video['sha256']), segment)
+    return path and (path, None, None, None)
+
+
+async def stream_file(scope, receive, send, resolve, *args):
+    headers = request_headers(scope)
+    if not server.focus_allowed(headers):
+        return await respond(send, 403)
+
+    loop = asyncio.get_running_loop()
+    target = await loop.run_in_executor(None, in_app_context, resolve, *args)
+    if target is None:
+        return await respond(send, 404)
+    try:
+        plan = await loop.run_in_executor(None, serving.plan_video, scope['method'], headers, *target)
+    except NotFound:
+        return await respond(send, 404)
+
+    try:
+        await send({'type': 'http.response.start', 'status': plan.status, 'headers': encode_headers(plan.headers)})
+        if plan.fp is None:
+            return await send({'type': 'http.response.body', 'body': b''})
+
+        streaming = asyncio.ensure_future(send_ranges(send, plan))
+        disconnect = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await asyncio.wait({streaming, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if streaming.done():
+                streaming.result()
+        finally:
+            streaming.cancel()
+            disconnect.cancel()
+    finally:
+        if plan.fp is not None:
+            plan.fp.close()
+
+
+def write_chunk(fp, hasher, chunk):
+    started = time.perf_counter()
+    fp.write(chunk)
+    metrics.record_disk_write(len(chunk), time.perf_counter() - started)
+    hasher.update(chunk)
+
+
+async def upload_video(scope, receive, send, user_id, filename):
+    filename = secure_filename(filename)
+    if not server.allowed_file(filename):
+        return await respond(send, 400, 'Type de fichier non autorisé'.encode('utf-8'))
+
+    headers = request_headers(scope)
+    limit = server.app.config['STREAM_MAX_CONTENT_LENGTH']
+    length = headers.get('Content-Length', type=int)
+    if (length or 0) > limit:
+        return await respond(send, 413)
+
+    loop = asyncio.get_running_loop()
+    ip = server.forwarded_ip((scope.get('client') or ('',))[0], headers.get('X-Forwarded-For'))
+    try:
+        slot = await loop.run_in_executor(None, in_app_context, server.admit_upload,
+                                          ip, user_id, filename, length)
+    except HTTPException as e:
+        return await respond_error(send, e)
+    metrics.UPLOADS_IN_FLIGHT.inc()
+    try:
+        await receive_video(scope, receive, send, user_id, filename, ip)
+    finally:
+        metrics.UPLOADS_IN_FLIGHT.dec()
+        await loop.run_in_executor(None, in_app_context, server.release_upload, slot)
+
+
+async def receive_video(scope, receive, send, user_id, filename, ip):
+    limit = server.app.config['STREAM_MAX_CONTENT_LENGTH']
+    throttled = bool(server.app.config['UPLOAD_BYTE_RATE'])
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, server.tmp_folder)
+    tmp_path = blobs.tmp_path(server.app.config['BLOB_FOLDER'])
+    fp = await loop.run_in_executor(None, open, tmp_path, 'wb')
+
+    hasher = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ConnectionResetError('client disconnected during upload')
+            buffer += message.get('body', b'')
+            size += len(message.get('body', b''))
+            if size > limit:
+                raise OverflowError
+            more = message.get('more_body', False)
+            if len(buffer) >= resumable.CHUNK_SIZE or (buffer and not more):
+                await loop.run_in_executor(None, write_chunk, fp, hasher, bytes(buffer))
+                if throttled:
+                    delay = await loop.run_in_executor(None, in_app_context, server.upload_delay,
+                                                       ip, user_id, len(buffer))
+                    if delay:
+                        await asyncio.sleep(delay)
+                buffer.clear()
+            if not more:
+                break
+        await loop.run_in_executor(None, fp.close)
+    except BaseException as e:
+        fp.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        if isinstance(e, OverflowError):
+            return await respond(send, 413)
+        raise
+
+    metrics.UPLOADED_BYTES.inc('upload_video', amount=size)
+    server.app.logger.info('Fichier reçu: %s, %d octets', filename, size)
+    try:
+        job_id = await loop.run_in_executor(None, in_app_context, server.register_video,
+                                            user_id, filename, tmp_path, hasher.hexdigest())
+    except HTTPException as e:
+        return await respond_error(send, e)
+    body = json.dumps({'user_id': user_id, 'filename': filename, 'size': size,
+                       'sha256': hasher.hexdigest(), 'job_id': job_id}).encode('utf-8')
+    await respond(send, 201, body, {'Digest': server.digest_header(hasher.digest())},
+                  content_type='application/json')
+
+
+async def metered(route, handler, scope, receive, send, *args):
+    # Same metrics as metrics.Middleware records for the Flask routes.
+    config = server.app.config
+    if not config['METRICS_ENABLED']:
+        return await handler(scope, receive, send, *args)
+
+    if config['METRICS_FOLDER']:
+        metrics.start_writer(config['METRICS_FOLDER'], config['METRICS_FLUSH_INTERVAL'])
+    started = time.perf_counter()
+    response = {'status': 500, 'sent': 0, 'first_byte': None}
+
+    async def metered_send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message.get('body'):
+            if response['first_byte'] is None:
+                response['first_byte'] = time.perf_counter()
+            response['sent'] += len(message['body'])
+        await send(message)
+
+    streaming = route in server.VIDEO_ROUTES
+    if streaming:
+        metrics.STREAMS_IN_FLIGHT.inc()
+    try:
+        await handler(scope, receive, metered_send, *args)
+    finally:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, route, scope['method'])
+        metrics.REQUESTS.inc(route, scope['method'], str(response['status']))
+        if response['sent']:
+            metrics.SERVED_BYTES.inc(route, amount=response['sent'])
+        if streaming:
+            metrics.STREAMS_IN_FLIGHT.dec()
+            if response['first_byte'] is not None:
+                metrics.VIDEO_TTFB.observe(response['first_byte'] - started, route)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            return await send({'type': 'lifespan.shutdown.complete'})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http':
+        parts = scope['path'].split('/')[1:]
+        method = scope['method']
+        offload = server.app.config['VIDEO_OFFLOAD']
+
+        if len(parts) == 3 and parts[0] == 'videos':
+            if method == 'PUT':
+                return await metered('upload_video', upload_video, scope, receive, send, parts[1], parts[2])
+            if method in ('GET', 'HEAD') and not offload:
+                return await metered('serve_video', stream_file, scope, receive, send,
+                                     resolve_video, parts[1], parts[2])
+        if len(parts) == 3 and parts[0] == 'blobs' and method in ('GET', 'HEAD') and not offload:
+            return await metered('serve_blob', stream_file, scope, receive, send,
+                                 resolve_blob, parts[1], parts[2])
+        if len(parts) == 4 and parts[0] == 'hls' and method in ('GET', 'HEAD'):
+            return await metered('serve_hls', stream_file, scope, receive, send,
+                                 resolve_hls, parts[1], parts[2], parts[3])
+
+    if flask_app is None:
+        return await respond(send, 501, b'asgiref is required for the other routes')
+    await flask_app(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    os.makedirs(server.UPLOAD_FOLDER, exist_ok=True)
+    with server.app.app_context():
+        server.reconcile()
+    uvicorn.run(app, host='0.0.0.0', port=5000)
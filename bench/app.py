@@ -0,0 +1,82 @@
+import argparse
+import os
+
+from flask import abort, request, send_from_directory
+
+import server
+
+
+@server.app.route('/legacy/<user_id>/<filename>')
+def legacy_serve_video(user_id, filename):
+    if request.headers.get('X-Focus') != 'stream_allowed':
+        abort(403)
+    video = server.resolve_video(user_id, filename)
+    if video is None:
+        abort(404)
+    path = server.blobs.blob_path(server.app.config['BLOB_FOLDER'], video['sha256'])
+    return send_from_directory(os.path.dirname(path), os.path.basename(path))
+
+
+def run_gunicorn(app, port, workers, threads):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', '127.0.0.1:%d' % port)
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def run_uvicorn(port):
+    import uvicorn
+
+    import asgi
+
+    uvicorn.run(asgi.app, host='127.0.0.1', port=port, log_level='warning', backlog=4096)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', required=True)
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn', 'uvicorn'], default='werkzeug')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--offload', choices=['x-accel-redirect', 'x-sendfile'])
+    parser.add_argument('--admission', action='store_true',
+                        help='keep the upload rate limits and quotas enabled')
+    args = parser.parse_args()
+
+    app = server.app
+    app.config['UPLOAD_FOLDER'] = os.path.join(args.root, 'uploads')
+    app.config['CATALOG_DATABASE'] = os.path.join(args.root, 'data', 'catalog.db')
+    app.config['BLOB_FOLDER'] = os.path.join(args.root, 'data', 'blobs')
+    app.config['HLS_FOLDER'] = os.path.join(args.root, 'data', 'hls')
+    app.config['POSTER_FOLDER'] = os.path.join(args.root, 'data', 'posters')
+    app.config['ADMISSION_DATABASE'] = os.path.join(args.root, 'data', 'admission.db')
+    app.config['METRICS_FOLDER'] = os.path.join(args.root, 'data', 'metrics')
+    app.config['PROFILE_FOLDER'] = os.path.join(args.root, 'data', 'profiles')
+    app.config['VIDEO_OFFLOAD'] = args.offload
+    if not args.admission:
+        for key in ('UPLOAD_REQUEST_RATE', 'UPLOAD_BYTE_RATE', 'USER_QUOTA', 'MAX_CONCURRENT_UPLOADS'):
+            app.config[key] = None
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    with app.app_context():
+        server.reconcile()
+
+    if args.server == 'gunicorn':
+        run_gunicorn(app, args.port, args.workers, args.threads)
+    elif args.server == 'uvicorn':
+        run_uvicorn(args.port)
+    else:
+        app.run(host='127.0.0.1', port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import contextlib
+import http.client
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FOCUS_HEADERS = {'X-Focus': 'stream_allowed'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with contextlib.suppress(OSError):
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        time.sleep(0.05)
+    raise RuntimeError('server did not start on port %d' % port)
+
+
+def child_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@contextlib.contextmanager
+def run_server(workdir, server='werkzeug', extra_args=()):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'bench.app', '--root', workdir, '--port', str(port),
+           '--server', server, *extra_args]
+    cpu_before = child_cpu()
+    proc = subprocess.Popen(cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    stats = {}
+    try:
+        wait_for_port(port)
+        yield port, stats
+    finally:
+        proc.terminate()
+        proc.wait()
+        # Only valid once the server has been reaped, which is why callers
+        # read it after leaving the block.
+        stats['server_cpu_seconds'] = child_cpu() - cpu_before
+
+
+def write_video(path, size, block=1024 * 1024):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pattern = os.urandom(block)
+    with open(path, 'wb') as fp:
+        remaining = size
+        while remaining:
+            n = min(block, remaining)
+            fp.write(pattern[:n])
+            remaining -= n
+
+
+def fetch(port, path, headers=None, chunk_size=1024 * 1024):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path, headers=headers or {})
+        response = conn.getresponse()
+        total = 0
+        while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+                break
+            total += len(chunk)
+        return response.status, total
+    finally:
+        conn.close()
+
+
+def percentiles(samples, points=(50, 95, 99)):
+    if not samples:
+        return {'p%d' % p: None for p in points}
+    ordered = sorted(samples)
+    return {'p%d' % p: ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] for p in points}
+
+
+def emit(result, output=None):
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'w') as fp:
+            fp.write(text + '\n')
+    print(text)
@@ -0,0 +1,137 @@
+"""Cost of the /metrics instrumentation on the request path.
+
+    python -m bench.metrics_overhead --requests 5000 --max-overhead-us 50
+
+Times the metric primitives and metrics.Middleware around a stub WSGI
+app, then sends the same requests through the Flask app in-process with
+METRICS_ENABLED on and off, alternating in rounds so that both see the
+same machine state. The run fails when the middleware adds more than
+--max-overhead-us per request; the end-to-end difference is reported
+alongside but is within the run-to-run noise of a real request.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from bench.common import FOCUS_HEADERS, emit, percentiles, write_video
+
+import metrics
+import server
+
+PRIMITIVES = {
+    'counter_inc': 'counter.inc("serve_video", amount=65536)',
+    'histogram_observe': 'histogram.observe(0.012, "serve_video", "GET")',
+    'record_disk_read': 'metrics.record_disk_read(65536, 0.0001)',
+}
+
+
+def time_primitives(number):
+    namespace = {
+        'metrics': metrics,
+        'counter': metrics.Counter('bench_total', '', ('route',)),
+        'histogram': metrics.Histogram('bench_seconds', '', ('route', 'method')),
+    }
+    return {name: min(timeit.repeat(stmt, number=number, repeat=5, globals=namespace)) / number * 1e9
+            for name, stmt in PRIMITIVES.items()}
+
+
+def stub_app(environ, start_response):
+    environ['focus.route'] = 'serve_video'
+    start_response('206 Partial Content', [('Content-Length', '65536')])
+    return [b'\0' * 65536]
+
+
+def time_middleware(number, enabled):
+    config = {'METRICS_ENABLED': enabled, 'METRICS_FOLDER': None, 'PROFILE_TOKEN': None}
+    middleware = metrics.Middleware(stub_app, config, ['serve_video'])
+
+    def request():
+        result = middleware({'REQUEST_METHOD': 'GET'}, lambda status, headers, exc_info=None: None)
+        for _ in result:
+            pass
+        if hasattr(result, 'close'):
+            result.close()
+    return min(timeit.repeat(request, number=number, repeat=5)) / number * 1e6
+
+
+def time_requests(client, path, headers, count):
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers, buffered=True)
+        samples.append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            raise RuntimeError('%s returned %d' % (path, response.status_code))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per target and mode')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--range-kb', type=int, default=64)
+    parser.add_argument('--profile-requests', type=int, default=20,
+                        help='requests sent with the profiling header on')
+    parser.add_argument('--max-overhead-us', type=float, default=50)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    app = server.app
+    with tempfile.TemporaryDirectory() as workdir:
+        for key, path in [('UPLOAD_FOLDER', 'uploads'), ('CATALOG_DATABASE', 'data/catalog.db'),
+                          ('ADMISSION_DATABASE', 'data/admission.db'), ('BLOB_FOLDER', 'data/blobs'),
+                          ('HLS_FOLDER', 'data/hls'), ('POSTER_FOLDER', 'data/posters'),
+                          ('PROFILE_FOLDER', 'data/profiles')]:
+            app.config[key] = os.path.join(workdir, path)
+        app.config['METRICS_FOLDER'] = None
+        app.config['PROFILE_TOKEN'] = 'bench'
+        app.logger.disabled = True
+        write_video(os.path.join(workdir, 'uploads', 'bench', 'video.mp4'), 16 * 1024 * 1024)
+        with app.app_context():
+            server.reconcile()
+
+        range_headers = dict(FOCUS_HEADERS, Range='bytes=0-%d' % (args.range_kb * 1024 - 1))
+        targets = {
+            'api_videos': ('/api/videos', {}),
+            'range_read': ('/videos/bench/video.mp4', range_headers),
+        }
+        client = app.test_client()
+        per_round = max(1, args.requests // args.rounds)
+        samples = {(name, mode): [] for name in targets for mode in ('off', 'on')}
+        for name, (path, headers) in targets.items():
+            time_requests(client, path, headers, per_round)
+            for _ in range(args.rounds):
+                for mode in ('off', 'on'):
+                    app.config['METRICS_ENABLED'] = mode == 'on'
+                    samples[name, mode] += time_requests(client, path, headers, per_round)
+
+        app.config['METRICS_ENABLED'] = True
+        profiled = time_requests(client, '/videos/bench/video.mp4',
+                                 dict(range_headers, **{metrics.PROFILE_HEADER: 'bench'}),
+                                 args.profile_requests)
+
+    middleware_us = time_middleware(20000, True) - time_middleware(20000, False)
+    result = {'config': vars(args), 'primitives_ns': time_primitives(100000),
+              'middleware_overhead_us': middleware_us, 'requests': {}}
+    for name in targets:
+        off = percentiles(samples[name, 'off'])
+        on = percentiles(samples[name, 'on'])
+        overhead = (on['p50'] - off['p50']) * 1e6
+        result['requests'][name] = {
+            'off_us': {key: value * 1e6 for key, value in off.items()},
+            'on_us': {key: value * 1e6 for key, value in on.items()},
+            'overhead_p50_us': overhead,
+            'overhead_p50_pct': overhead / (off['p50'] * 1e6) * 100,
+        }
+    result['profiled_us'] = {key: value * 1e6 for key, value in percentiles(profiled).items()}
+    result['passed'] = middleware_us <= args.max_overhead_us
+    emit(result, args.output)
+    if not result['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Throughput and server CPU per GB for serve_video, before and after.
+
+    python -m bench.serve_video --size-mb 512 --requests 20 --server gunicorn
+
+'legacy' is the send_from_directory implementation serve_video used to
+have, 'videos' is the current route. Run with --server gunicorn to get
+the sendfile() path; the werkzeug development server has no
+wsgi.file_wrapper and always copies through Python.
+"""
+import argparse
+import concurrent.futures
+import random
+import tempfile
+import time
+
+from bench.common import FOCUS_HEADERS, emit, fetch, run_server, write_video
+
+ROUTES = ('legacy', 'videos')
+
+
+def run(route, args, workdir, size):
+    def one(i):
+        headers = dict(FOCUS_HEADERS)
+        if args.range_kb:
+            start = random.randrange(0, size - args.range_kb * 1024)
+            headers['Range'] = 'bytes=%d-%d' % (start, start + args.range_kb * 1024 - 1)
+        status, n = fetch(port, '/%s/bench/video.mp4' % route, headers)
+        assert status in (200, 206), status
+        return n
+
+    with run_server(workdir, args.server) as (port, stats):
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+            served = sum(pool.map(one, range(args.requests)))
+        elapsed = time.perf_counter() - started
+
+    gigabytes = served / 1024 ** 3
+    return {
+        'bytes': served,
+        'seconds': elapsed,
+        'mb_per_second': served / 1024 ** 2 / elapsed,
+        'server_cpu_seconds': stats['server_cpu_seconds'],
+        'server_cpu_seconds_per_gb': stats['server_cpu_seconds'] / gigabytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--range-kb', type=int, default=0,
+                        help='request random ranges of this size instead of whole files')
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    size = args.size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as workdir:
+        write_video('%s/uploads/bench/video.mp4' % workdir, size)
+        result = {'config': vars(args)}
+        for route in ROUTES:
+            result[route] = run(route, args, workdir, size)
+    emit(result, args.output)
+
+
+if __name__ == '__main__':
+    main()
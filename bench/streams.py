@@ -0,0 +1,102 @@
+"""Concurrent long-lived video streams: WSGI threads against the ASGI mode.
+
+    python -m bench.streams --streams 2000 --hold 20 --servers gunicorn,uvicorn
+
+Each client requests the same video and reads it at a player-like pace
+for --hold seconds. A stream counts as served when its response headers
+arrive within --timeout. gunicorn runs gthread with --threads threads,
+so its capacity is bounded by the thread count; uvicorn serves asgi.app.
+"""
+import argparse
+import asyncio
+import resource
+import tempfile
+import time
+
+from bench.common import emit, percentiles, run_server, write_video
+
+REQUEST = (b'GET /videos/bench/video.mp4 HTTP/1.1\r\n'
+           b'Host: 127.0.0.1\r\nX-Focus: stream_allowed\r\nConnection: close\r\n\r\n')
+
+
+async def viewer(port, args, ttfb, errors):
+    started = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), args.timeout)
+    except (OSError, asyncio.TimeoutError) as e:
+        errors.append(type(e).__name__)
+        return
+    try:
+        writer.write(REQUEST)
+        status = await asyncio.wait_for(reader.readline(), args.timeout)
+        if not status.startswith(b'HTTP/1.1 200'):
+            errors.append(status.decode('latin-1').strip() or 'empty response')
+            return
+        ttfb.append(time.perf_counter() - started)
+
+        deadline = time.monotonic() + args.hold
+        while time.monotonic() < deadline:
+            if not await reader.read(args.read_kb * 1024):
+                break
+            await asyncio.sleep(args.read_interval)
+    except (OSError, asyncio.TimeoutError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+
+async def load(port, args):
+    ttfb, errors = [], []
+    tasks = []
+    for _ in range(args.streams):
+        tasks.append(asyncio.ensure_future(viewer(port, args, ttfb, errors)))
+        await asyncio.sleep(args.ramp / args.streams)
+    await asyncio.gather(*tasks)
+    return ttfb, errors
+
+
+def run(server, args, workdir):
+    extra = ['--threads', str(args.threads), '--workers', str(args.workers)]
+    with run_server(workdir, server, extra) as (port, stats):
+        ttfb, errors = asyncio.run(load(port, args))
+
+    result = {
+        'streams': args.streams,
+        'served': len(ttfb),
+        'failed': len(errors),
+        'errors': sorted(set(errors)),
+        'server_cpu_seconds': stats['server_cpu_seconds'],
+    }
+    result.update({'ttfb_%s_ms' % key: value * 1000 if value is not None else None
+                   for key, value in percentiles(ttfb).items()})
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--streams', type=int, default=500)
+    parser.add_argument('--hold', type=float, default=10, help='seconds each viewer keeps reading')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which viewers connect')
+    parser.add_argument('--timeout', type=float, default=5)
+    parser.add_argument('--read-kb', type=int, default=64)
+    parser.add_argument('--read-interval', type=float, default=0.5)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--servers', default='gunicorn,uvicorn')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        write_video('%s/uploads/bench/video.mp4' % workdir, args.size_mb * 1024 * 1024)
+        result = {'config': vars(args)}
+        for server in args.servers.split(','):
+            result[server] = run(server, args, workdir)
+    emit(result, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""Benchmark suite for the upload, listing and streaming paths.
+
+    python -m bench.suite run --output before.json
+    python -m bench.suite run --output after.json
+    python -m bench.suite compare before.json after.json --threshold 10
+
+'run' starts a local server (bench.app) on generated files and measures:
+
+- upload: multipart POST / with --uploads files of --upload-mb each
+- listing: GET /, GET /?user_id=... and GET /api/videos as the catalog
+  grows through --listing-sizes files, added in place between steps
+- range_sequential / range_random: --range-kb Range reads of a
+  --range-mb video through serve_video, front to back and at offsets
+  drawn from --seed
+
+Every latency is reported as p50/p95/p99 in milliseconds and every data
+path as MB/s. 'compare' matches the numbers of two result files and flags
+a latency that grew, or a throughput that dropped, by more than
+--threshold percent.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import http.client
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.common import FOCUS_HEADERS, ROOT, emit, percentiles, run_server, write_video
+
+import blobs
+import server
+
+SCENARIOS = ('upload', 'listing', 'range_sequential', 'range_random')
+BOUNDARY = 'focusbenchboundary'
+
+
+def request(port, method, path, headers=None, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        started = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers or {})
+        response = conn.getresponse()
+        size = len(response.read())
+        return response.status, size, time.perf_counter() - started
+    finally:
+        conn.close()
+
+
+def measure(port, count, make, concurrency, ok=(200,)):
+    # make(i) returns the (method, path, headers, body) of the i-th request,
+    # built on demand so that upload bodies are not all held at once.
+    def one(i):
+        method, path, headers, body = make(i)
+        status, size, seconds = request(port, method, path, headers, body)
+        if status not in ok:
+            raise RuntimeError('%s %s returned %d' % (method, path, status))
+        return seconds, size + len(body or b'')
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(one, range(count)))
+    elapsed = time.perf_counter() - started
+    latencies = [seconds for seconds, _ in results]
+    moved = sum(size for _, size in results)
+    return {
+        'requests': len(results),
+        'seconds': elapsed,
+        'throughput_mb_s': moved / 1024 ** 2 / elapsed,
+        'latency_ms': {key: value * 1000 for key, value in percentiles(latencies).items()},
+    }
+
+
+def multipart(user_id, filename, data):
+    head = ('--{b}\r\nContent-Disposition: form-data; name="user_id"\r\n\r\n{user}\r\n'
+            '--{b}\r\nContent-Disposition: form-data; name="video"; filename="{name}"\r\n'
+            'Content-Type: video/mp4\r\n\r\n').format(b=BOUNDARY, user=user_id, name=filename)
+    body = head.encode('utf-8') + data + ('\r\n--%s--\r\n' % BOUNDARY).encode('ascii')
+    return {'Content-Type': 'multipart/form-data; boundary=' + BOUNDARY}, body
+
+
+def configure(workdir):
+    app = server.app
+    app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    app.config['CATALOG_DATABASE'] = os.path.join(workdir, 'data', 'catalog.db')
+    app.config['ADMISSION_DATABASE'] = os.path.join(workdir, 'data', 'admission.db')
+    app.config['BLOB_FOLDER'] = os.path.join(workdir, 'data', 'blobs')
+    app.config['HLS_FOLDER'] = os.path.join(workdir, 'data', 'hls')
+    app.config['POSTER_FOLDER'] = os.path.join(workdir, 'data', 'posters')
+    app.logger.disabled = True
+
+
+def populate(workdir, start, stop, args):
+    # Files are written into uploads/ and imported here rather than by the
+    # server, whose startup would otherwise time out on large steps.
+    rng = random.Random('%s-%d-%d' % (args.seed, start, stop))
+    block = rng.randbytes(args.listing_kb * 1024)
+    for i in range(start, stop):
+        folder = os.path.join(workdir, 'uploads', 'user%03d' % (i % args.listing_users))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, 'video%06d.mp4' % i), 'wb') as fp:
+            fp.write(i.to_bytes(8, 'big') + block[8:])
+    with server.app.app_context():
+        app = server.app
+        blobs.import_tree(server.get_catalog(), app.config['BLOB_FOLDER'], app.config['UPLOAD_FOLDER'])
+
+
+def server_args(args):
+    return ['--workers', str(args.workers), '--threads', str(args.threads)]
+
+
+def bench_upload(args, workdir):
+    rng = random.Random(args.seed)
+    data = rng.randbytes(args.upload_mb * 1024 * 1024)
+
+    def make(i):
+        # A distinct prefix per file keeps the blob store from deduplicating.
+        headers, body = multipart('upload%d' % (i % 10), 'video%04d.mp4' % i, i.to_bytes(8, 'big') + data[8:])
+        return 'POST', '/', headers, body
+
+    with run_server(workdir, args.server, server_args(args)) as (port, stats):
+        result = measure(port, args.uploads, make, args.concurrency, ok=(302,))
+    result['server_cpu_seconds'] = stats['server_cpu_seconds']
+    return result
+
+
+def bench_listing(args, workdir):
+    results = {}
+    count = 0
+    for size in args.listing_sizes:
+        populate(workdir, count, size, args)
+        count = size
+        targets = {
+            'index': '/',
+            'index_user': '/?user_id=user%03d' % (size // 2 % args.listing_users),
+            'api_videos': '/api/videos',
+        }
+        results[str(size)] = {}
+        with run_server(workdir, args.server, server_args(args)) as (port, stats):
+            for name, path in targets.items():
+                spec = ('GET', path, None, None)
+                measure(port, 5, lambda i: spec, 1)
+                results[str(size)][name] = measure(port, args.listing_requests, lambda i: spec, args.concurrency)
+    return results
+
+
+def bench_ranges(args, workdir, pattern):
+    size = args.range_mb * 1024 * 1024
+    write_video(os.path.join(workdir, 'uploads', 'bench', 'video.mp4'), size)
+
+    chunk = args.range_kb * 1024
+    if pattern == 'sequential':
+        offsets = [start % (size - chunk + 1) for start in range(0, args.range_requests * chunk, chunk)]
+    else:
+        rng = random.Random(args.seed)
+        offsets = [rng.randrange(0, size - chunk + 1) for _ in range(args.range_requests)]
+
+    def make(i):
+        headers = dict(FOCUS_HEADERS, Range='bytes=%d-%d' % (offsets[i], offsets[i] + chunk - 1))
+        return 'GET', '/videos/bench/video.mp4', headers, None
+
+    with run_server(workdir, args.server, server_args(args)) as (port, stats):
+        result = measure(port, len(offsets), make, args.concurrency, ok=(206,))
+    result['server_cpu_seconds'] = stats['server_cpu_seconds']
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    result = {
+        'meta': {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        },
+        'config': {key: value for key, value in vars(args).items() if key not in ('func', 'output')},
+        'results': {},
+    }
+    for scenario in args.scenarios:
+        # Each scenario gets its own tree so that one cannot warm the
+        # page cache or grow the catalog for the next.
+        with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+            configure(workdir)
+            print('running %s' % scenario, file=sys.stderr)
+            if scenario == 'upload':
+                result['results'][scenario] = bench_upload(args, workdir)
+            elif scenario == 'listing':
+                result['results'][scenario] = bench_listing(args, workdir)
+            else:
+                result['results'][scenario] = bench_ranges(args, workdir, scenario.split('_')[1])
+    emit(result, args.output)
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, child in value.items():
+            yield from flatten(child, '%s.%s' % (prefix, key) if prefix else key)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def direction(key):
+    # +1 when a larger number is better, -1 when smaller is, None when the
+    # number is not a performance figure.
+    if '.latency_ms.' in key:
+        return -1
+    if key.endswith('throughput_mb_s'):
+        return 1
+    return None
+
+
+def compare(args):
+    with open(args.base) as fp:
+        base = dict(flatten(json.load(fp)['results']))
+    with open(args.new) as fp:
+        new = dict(flatten(json.load(fp)['results']))
+
+    rows = []
+    regressions = []
+    for key in sorted(set(base) & set(new)):
+        better = direction(key)
+        if better is None:
+            continue
+        change = (new[key] - base[key]) / base[key] * 100 if base[key] else 0.0
+        regressed = change * better < -args.threshold
+        if regressed:
+            regressions.append(key)
+        rows.append({'metric': key, 'base': base[key], 'new': new[key], 'change_pct': change,
+                     'regressed': regressed})
+
+    width = max([len(row['metric']) for row in rows] + [6])
+    print('%-*s %12s %12s %9s' % (width, 'metric', 'base', 'new', 'change'))
+    for row in rows:
+        print('%-*s %12.3f %12.3f %+8.1f%%%s' % (width, row['metric'], row['base'], row['new'],
+                                               row['change_pct'], '  REGRESSED' if row['regressed'] else ''))
+    if args.output:
+        emit({'threshold_pct': args.threshold, 'rows': rows, 'regressions': regressions}, args.output)
+    if regressions and args.fail:
+        sys.exit(1)
+
+
+def sizes(value):
+    return [int(size) for size in value.split(',')]
+
+
+def scenarios(value):
+    names = value.split(',')
+    for name in names:
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError('unknown scenario %r' % name)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run the benchmarks and write a result file')
+    run_parser.add_argument('--scenarios', type=scenarios, default=list(SCENARIOS))
+    run_parser.add_argument('--server', choices=['werkzeug', 'gunicorn', 'uvicorn'], default='gunicorn')
+    run_parser.add_argument('--workers', type=int, default=2)
+    run_parser.add_argument('--threads', type=int, default=8)
+    run_parser.add_argument('--concurrency', type=int, default=4)
+    run_parser.add_argument('--seed', type=int, default=1)
+    run_parser.add_argument('--uploads', type=int, default=40)
+    run_parser.add_argument('--upload-mb', type=int, default=16)
+    run_parser.add_argument('--listing-sizes', type=sizes, default=[10, 100, 1000, 10000, 100000])
+    run_parser.add_argument('--listing-users', type=int, default=100)
+    run_parser.add_argument('--listing-kb', type=int, default=4)
+    run_parser.add_argument('--listing-requests', type=int, default=200)
+    run_parser.add_argument('--range-mb', type=int, default=256)
+    run_parser.add_argument('--range-kb', type=int, default=256)
+    run_parser.add_argument('--range-requests', type=int, default=500)
+    run_parser.add_argument('--workdir', help='parent directory for the generated trees')
+    run_parser.add_argument('--output')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two result files')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=10,
+                                help='percent change counted as a regression')
+    compare_parser.add_argument('--fail', action='store_true', help='exit with status 1 on a regression')
+    compare_parser.add_argument('--output')
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
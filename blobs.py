@@ -0,0 +1,104 @@
+import contextlib
+import hashlib
+import os
+import secrets
+import shutil
+import time
+
+import catalog
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blobs_unreferenced ON blobs (refcount) WHERE refcount <= 0;
+'''
+
+TMP_FOLDER = '.tmp'
+CHUNK_SIZE = 1024 * 1024
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+def blob_path(folder, sha256):
+    return os.path.join(folder, sha256[:2], sha256[2:])
+
+
+def tmp_path(folder):
+    return os.path.join(folder, TMP_FOLDER, secrets.token_hex(16))
+
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def store(conn, folder, tmp, sha256, user_id, filename, size):
+    # Placing the file and taking the reference share one write transaction
+    # with collect(), so a blob cannot be collected between the existence
+    # check and the reference that keeps it alive.
+    path = blob_path(folder, sha256)
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        known = conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+        if known and os.path.exists(path):
+            os.remove(tmp)
+            created = False
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp, path)
+            created = True
+
+        old = conn.execute('SELECT sha256 FROM videos WHERE user_id = ? AND filename = ?',
+                           (user_id, filename)).fetchone()
+        conn.execute(catalog.UPSERT_VIDEO, (user_id, filename, size, time.time(), sha256))
+        if old is None or old['sha256'] != sha256:
+            conn.execute(
+                'INSERT INTO blobs (sha256, size, refcount, created) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (sha256) DO UPDATE SET refcount = refcount + 1',
+                (sha256, size, time.time()))
+            if old is not None and old['sha256']:
+                conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?', (old['sha256'],))
+    return created
+
+
+def collect(conn, folder):
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        rows = conn.execute('DELETE FROM blobs WHERE refcount <= 0 RETURNING sha256, size').fetchall()
+        for row in rows:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(blob_path(folder, row['sha256']))
+    return rows
+
+
+def import_tree(conn, folder, root):
+    imported = 0
+    for user_id, filename, size, mtime in list(catalog.scan(root)):
+        source = os.path.join(root, user_id, filename)
+        sha256 = hash_file(source)
+        tmp = tmp_path(folder)
+        os.makedirs(os.path.dirname(tmp), exist_ok=True)
+        shutil.move(source, tmp)
+        # A rename keeps the old mtime, which would let gc take the file
+        # for an abandoned upload if store() does not get to it.
+        os.utime(tmp)
+        try:
+            store(conn, folder, tmp, sha256, user_id, filename, size)
+        except BaseException:
+            if os.path.exists(tmp):
+                shutil.move(tmp, source)
+            raise
+        imported += 1
+    return imported
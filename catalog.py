@@ -0,0 +1,76 @@
+import os
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT,
+    UNIQUE (user_id, filename)
+);
+CREATE INDEX IF NOT EXISTS videos_user_id ON videos (user_id, id);
+'''
+
+UPSERT_VIDEO = (
+    'INSERT INTO videos (user_id, filename, size, mtime, sha256) VALUES (?, ?, ?, ?, ?) '
+    'ON CONFLICT (user_id, filename) DO UPDATE SET '
+    'size = excluded.size, mtime = excluded.mtime, sha256 = excluded.sha256')
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+    columns = {row['name'] for row in conn.execute('PRAGMA table_info(videos)')}
+    if 'sha256' not in columns:
+        conn.execute('ALTER TABLE videos ADD COLUMN sha256 TEXT')
+
+
+def get_video(conn, user_id, filename):
+    return conn.execute('SELECT * FROM videos WHERE user_id = ? AND filename = ?',
+                        (user_id, filename)).fetchone()
+
+
+def list_videos(conn, user_id=None, cursor=0, limit=50):
+    if user_id:
+        rows = conn.execute(
+            'SELECT id, user_id, filename, size, mtime, sha256 FROM videos '
+            'WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+            (user_id, cursor, limit + 1)).fetchall()
+    else:
+        rows = conn.execute(
+            'SELECT id, user_id, filename, size, mtime, sha256 FROM videos '
+            'WHERE id > ? ORDER BY id LIMIT ?',
+            (cursor, limit + 1)).fetchall()
+
+    next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def usage_totals(conn):
+    return conn.execute('SELECT user_id, SUM(size) FROM videos GROUP BY user_id').fetchall()
+
+
+def scan(root):
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as users:
+        for user in users:
+            if user.name.startswith('.') or not user.is_dir():
+                continue
+            with os.scandir(user.path) as files:
+                for entry in files:
+                    if entry.name.startswith('.') or not entry.is_file():
+                        continue
+                    st = entry.stat()
+                    yield user.name, entry.name, st.st_size, st.st_mtime
+
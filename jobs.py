@@ -0,0 +1,233 @@
+import logging
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import subprocess
+import time
+
+import blobs
+import catalog
+import media
+import processes
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_video ON jobs (user_id, filename, id);
+'''
+
+PLAYLIST = 'index.m3u8'
+
+logger = logging.getLogger(__name__)
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+def enqueue(conn, kind, user_id, filename):
+    with conn:
+        cur = conn.execute(
+            'INSERT INTO jobs (kind, user_id, filename, created) VALUES (?, ?, ?, ?)',
+            (kind, user_id, filename, time.time()))
+    return cur.lastrowid
+
+
+def enqueue_for_blob(conn, kind, user_id, filename, sha256):
+    # Outputs are keyed by blob, so a second job for the same content would
+    # only rebuild them under viewers. Returns None when one is pending.
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        pending = conn.execute(
+            'SELECT 1 FROM jobs JOIN videos USING (user_id, filename) '
+            "WHERE jobs.kind = ? AND jobs.status IN ('queued', 'running') AND videos.sha256 = ?",
+            (kind, sha256)).fetchone()
+        if pending:
+            return None
+        cur = conn.execute(
+            'INSERT INTO jobs (kind, user_id, filename, created) VALUES (?, ?, ?, ?)',
+            (kind, user_id, filename, time.time()))
+    return cur.lastrowid
+
+
+def get_job(conn, job_id):
+    return conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+
+def claim(conn, worker):
+    with conn:
+        return conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, started = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1) "
+            "RETURNING *",
+            (worker, time.time())).fetchone()
+
+
+def finish(conn, job_id, error=None):
+    with conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?',
+            ('failed' if error else 'done', error, time.time(), job_id))
+
+
+def worker_name():
+    return '%s:%d' % (os.uname().nodename, os.getpid())
+
+
+def requeue_running(conn):
+    # Only jobs whose worker process ran on this host and is gone; another
+    # pool may be running next to this one, and other hosts are left to
+    # requeue their own.
+    host = os.uname().nodename
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        dead = []
+        for row in conn.execute("SELECT id, worker FROM jobs WHERE status = 'running'").fetchall():
+            worker_host, _, pid = (row['worker'] or '').rpartition(':')
+            if worker_host == host and pid.isdigit() and not processes.pid_alive(int(pid)):
+                dead.append((row['id'],))
+        conn.executemany(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started = NULL WHERE id = ?", dead)
+    return len(dead)
+
+
+def hls_folder(folder, sha256):
+    return os.path.join(folder, sha256)
+
+
+def is_packaged(folder, sha256):
+    return os.path.isfile(os.path.join(hls_folder(folder, sha256), PLAYLIST))
+
+
+def job_blob(conn, job):
+    video = catalog.get_video(conn, job['user_id'], job['filename'])
+    if video is None or not video['sha256']:
+        raise RuntimeError('%s/%s is not in the catalog' % (job['user_id'], job['filename']))
+    return video['sha256']
+
+
+def run_command(command, timeout, **values):
+    args = [arg.format(**values) for arg in command]
+    result = subprocess.run(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', 'replace')[-2000:] or
+                           'exit status %d' % result.returncode)
+
+
+def transcode(conn, job, settings):
+    sha256 = job_blob(conn, job)
+    if is_packaged(settings['hls_folder'], sha256):
+        return
+
+    source = blobs.blob_path(settings['blob_folder'], sha256)
+    output_dir = hls_folder(settings['hls_folder'], sha256)
+    build_dir = '%s.tmp-%d' % (output_dir, job['id'])
+
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+    try:
+        run_command(settings['transcode_command'], settings['timeout'],
+                    input=source, output_dir=build_dir, playlist=os.path.join(build_dir, PLAYLIST))
+        if not os.path.isfile(os.path.join(build_dir, PLAYLIST)):
+            raise RuntimeError('%s not produced' % PLAYLIST)
+        if is_packaged(settings['hls_folder'], sha256):
+            # Packaged by another job meanwhile; its output may be streaming.
+            return
+        shutil.rmtree(output_dir, ignore_errors=True)
+        try:
+            os.replace(build_dir, output_dir)
+        except OSError:
+            if not is_packaged(settings['hls_folder'], sha256):
+                raise
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+
+def extract_poster(conn, job, settings):
+    sha256 = job_blob(conn, job)
+    output = media.poster_path(settings['poster_folder'], sha256)
+    if os.path.isfile(output):
+        return
+
+    os.makedirs(settings['poster_folder'], exist_ok=True)
+    tmp = '%s.tmp-%d.jpg' % (output, job['id'])
+    try:
+        run_command(settings['poster_command'], settings['timeout'],
+                    input=blobs.blob_path(settings['blob_folder'], sha256), output=tmp)
+        if not os.path.isfile(tmp):
+            raise RuntimeError('poster not produced')
+        os.replace(tmp, output)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+HANDLERS = {
+    'hls': transcode,
+    'poster': extract_poster,
+}
+
+
+def work(database, settings, poll_interval):
+    worker = worker_name()
+    conn = catalog.connect(database)
+    while True:
+        # A locked database outlasting the connection timeout must not end
+        # the process; run_pool does not start a replacement.
+        try:
+            job = claim(conn, worker)
+        except sqlite3.Error:
+            logger.exception('Could not claim a job')
+            time.sleep(poll_interval)
+            continue
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        error = None
+        try:
+            if job['kind'] in HANDLERS:
+                HANDLERS[job['kind']](conn, job, settings)
+            else:
+                error = 'unknown job kind %r' % job['kind']
+        except Exception as e:
+            logger.exception('Job %d failed', job['id'])
+            error = str(e) or e.__class__.__name__
+        # Left as running, the job would only be requeued once this
+        # process is gone.
+        while True:
+            try:
+                finish(conn, job['id'], error)
+                break
+            except sqlite3.Error:
+                logger.exception('Could not record the end of job %d', job['id'])
+                time.sleep(poll_interval)
+
+
+def run_pool(database, settings, processes, poll_interval=1.0):
+    conn = catalog.connect(database)
+    init(conn)
+    requeued = requeue_running(conn)
+    conn.close()
+    if requeued:
+        logger.info('%d interrupted jobs requeued', requeued)
+
+    args = (database, settings, poll_interval)
+    pool = [multiprocessing.Process(target=work, args=args, daemon=True) for _ in range(processes)]
+    for process in pool:
+        process.start()
+    for process in pool:
+        process.join()
@@ -0,0 +1,172 @@
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    sha256 TEXT PRIMARY KEY,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    video_codec TEXT,
+    audio_codec TEXT,
+    bitrate INTEGER
+);
+'''
+
+FIELDS = ('duration', 'width', 'height', 'video_codec', 'audio_codec', 'bitrate')
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+def save_metadata(conn, sha256, metadata):
+    with conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO media (sha256, duration, width, height, video_codec, audio_codec, bitrate) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (sha256, *(metadata.get(field) for field in FIELDS)))
+
+
+def get_metadata(conn, sha256):
+    return conn.execute('SELECT * FROM media WHERE sha256 = ?', (sha256,)).fetchone()
+
+
+def delete_metadata(conn, sha256s):
+    with conn:
+        conn.executemany('DELETE FROM media WHERE sha256 = ?', [(sha256,) for sha256 in sha256s])
+
+
+def poster_path(folder, sha256):
+    return os.path.join(folder, sha256 + '.jpg')
+
+
+def iter_boxes(data, start, end):
+    while start + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, start)
+        header = 8
+        if size == 1:
+            if start + 16 > end:
+                return
+            size, header = struct.unpack_from('>Q', data, start + 8)[0], 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+
+def find_box(data, start, end, *path):
+    for name in path:
+        for kind, box_start, box_end in iter_boxes(data, start, end):
+            if kind == name:
+                start, end = box_start, box_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def read_moov(fp):
+    # Only the box headers are read on the way to moov, so a file with moov
+    # after mdat costs a few seeks rather than a full read.
+    size = os.fstat(fp.fileno()).st_size
+    offset = 0
+    while offset + 8 <= size:
+        fp.seek(offset)
+        header = fp.read(16)
+        if len(header) < 8:
+            return None
+        box_size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if box_size == 1 and len(header) == 16:
+            box_size, header_size = struct.unpack_from('>Q', header, 8)[0], 16
+        elif box_size == 0:
+            box_size = size - offset
+        if box_size < header_size:
+            return None
+        if kind == b'moov':
+            if box_size > MAX_MOOV_SIZE:
+                return None
+            fp.seek(offset + header_size)
+            return fp.read(box_size - header_size)
+        offset += box_size
+    return None
+
+
+def parse_track(moov, start, end, metadata):
+    handler = find_box(moov, start, end, b'mdia', b'hdlr')
+    stsd = find_box(moov, start, end, b'mdia', b'minf', b'stbl', b'stsd')
+    if handler is None or handler[1] - handler[0] < 12:
+        return
+    handler_type = moov[handler[0] + 8:handler[0] + 12]
+    codec = None
+    if stsd is not None and stsd[1] - stsd[0] >= 16:
+        codec = moov[stsd[0] + 12:stsd[0] + 16].decode('latin-1').strip()
+
+    if handler_type == b'vide' and metadata.get('video_codec') is None:
+        metadata['video_codec'] = codec
+        tkhd = find_box(moov, start, end, b'tkhd')
+        if tkhd is not None and tkhd[1] - tkhd[0] >= 84:
+            width, height = struct.unpack_from('>II', moov, tkhd[1] - 8)
+            metadata['width'], metadata['height'] = width >> 16, height >> 16
+    elif handler_type == b'soun' and metadata.get('audio_codec') is None:
+        metadata['audio_codec'] = codec
+
+
+def parse_mp4(path):
+    with open(path, 'rb') as fp:
+        moov = read_moov(fp)
+        size = os.fstat(fp.fileno()).st_size
+    if moov is None:
+        return None
+
+    metadata = {}
+    mvhd = find_box(moov, 0, len(moov), b'mvhd')
+    if mvhd is not None and mvhd[1] - mvhd[0] >= 20:
+        if moov[mvhd[0]] == 1 and mvhd[1] - mvhd[0] >= 32:
+            timescale, duration = struct.unpack_from('>IQ', moov, mvhd[0] + 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', moov, mvhd[0] + 12)
+        if timescale:
+            metadata['duration'] = duration / timescale
+
+    for kind, start, end in iter_boxes(moov, 0, len(moov)):
+        if kind == b'trak':
+            parse_track(moov, start, end, metadata)
+
+    if metadata.get('duration'):
+        metadata['bitrate'] = int(size * 8 / metadata['duration'])
+    return metadata
+
+
+class LRUCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
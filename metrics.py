@@ -0,0 +1,387 @@
+import bisect
+import collections
+import contextlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+
+import processes
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+PROFILE_HEADER = 'X-Focus-Profile'
+PROFILE_ENVIRON_KEY = 'HTTP_X_FOCUS_PROFILE'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in pairs)
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    def merge(self, total, value):
+        return value if total is None else total + value
+
+    def lines(self, key, value):
+        yield '%s%s %s' % (self.name, format_labels(self.labels, key), format_value(value))
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): list(value) for key, value in self._values.items()}
+
+    def merge(self, total, value):
+        return list(value) if total is None else [a + b for a, b in zip(total, value)]
+
+    def lines(self, key, value):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), value):
+            cumulative += count
+            yield '%s_bucket%s %d' % (self.name, format_labels(self.labels, key, [('le', format_value(bound))]),
+                                      cumulative)
+        yield '%s_sum%s %s' % (self.name, format_labels(self.labels, key), format_value(value[-1]))
+        yield '%s_count%s %d' % (self.name, format_labels(self.labels, key), cumulative)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def render(self, snapshots):
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    merged[key] = metric.merge(merged.get(key), value)
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for key in sorted(merged):
+                lines.extend(metric.lines(json.loads(key), merged[key]))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_SECONDS = REGISTRY.add(Histogram(
+    'focus_http_request_duration_seconds', 'Time from receiving a request to closing its response.',
+    ('route', 'method')))
+REQUESTS = REGISTRY.add(Counter(
+    'focus_http_requests_total', 'Requests handled, by response status.', ('route', 'method', 'status')))
+UPLOADED_BYTES = REGISTRY.add(Counter(
+    'focus_uploaded_bytes_total', 'Video bytes received from clients.', ('route',)))
+SERVED_BYTES = REGISTRY.add(Counter(
+    'focus_served_bytes_total', 'Response body bytes sent to clients.', ('route',)))
+VIDEO_TTFB = REGISTRY.add(Histogram(
+    'focus_video_ttfb_seconds', 'Time from receiving a video request to its first body byte.', ('route',)))
+DISK_READ_BYTES = REGISTRY.add(Counter(
+    'focus_disk_read_bytes_total', 'Bytes read from video files in user space (sendfile is not counted).'))
+DISK_READ_SECONDS = REGISTRY.add(Counter(
+    'focus_disk_read_seconds_total', 'Time spent reading video files in user space.'))
+DISK_WRITE_BYTES = REGISTRY.add(Counter(
+    'focus_disk_write_bytes_total', 'Bytes of uploads written to disk.'))
+DISK_WRITE_SECONDS = REGISTRY.add(Counter(
+    'focus_disk_write_seconds_total', 'Time spent writing uploads to disk.'))
+UPLOADS_IN_FLIGHT = REGISTRY.add(Gauge(
+    'focus_uploads_in_flight', 'Uploads currently being received.'))
+STREAMS_IN_FLIGHT = REGISTRY.add(Gauge(
+    'focus_streams_in_flight', 'Video responses currently being sent.'))
+TEMPLATE_SECONDS = REGISTRY.add(Histogram(
+    'focus_template_render_seconds', 'Time spent rendering templates.', ('template',), RENDER_BUCKETS))
+FOCUS_DENIED = REGISTRY.add(Counter(
+    'focus_forbidden_total', 'Requests refused with 403 by the X-Focus check.'))
+
+
+def record_disk_read(size, seconds):
+    DISK_READ_BYTES.inc(amount=size)
+    DISK_READ_SECONDS.inc(amount=seconds)
+
+
+def record_disk_write(size, seconds):
+    DISK_WRITE_BYTES.inc(amount=size)
+    DISK_WRITE_SECONDS.inc(amount=seconds)
+
+
+# Every worker process keeps its own registry and a thread that writes it to
+# <folder>/<pid>.json every few seconds; /metrics adds up the files of the
+# processes that are still alive. Counters of a dead worker disappear with
+# it, which Prometheus treats as a counter reset.
+_writer_pid = None
+
+
+def write_snapshot(folder):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, '%d.json' % os.getpid())
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(REGISTRY.snapshot(), fp)
+    os.replace(path + '.tmp', path)
+
+
+def start_writer(folder, interval):
+    # Started from the first request rather than at import time, so that it
+    # runs in each worker forked by the server and not only in the master.
+    global _writer_pid
+    if _writer_pid == os.getpid():
+        return
+    _writer_pid = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                write_snapshot(folder)
+            except OSError:
+                pass
+    threading.Thread(target=run, daemon=True).start()
+
+
+def collect(folder=None):
+    snapshots = [REGISTRY.snapshot()]
+    if folder is None or not os.path.isdir(folder):
+        return snapshots
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            pid, _, ext = entry.name.partition('.')
+            if ext != 'json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            if not processes.pid_alive(int(pid)):
+                # Another worker serving /metrics may remove it first.
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+                continue
+            try:
+                with open(entry.path) as fp:
+                    snapshots.append(json.load(fp))
+            except (OSError, ValueError):
+                continue
+    return snapshots
+
+
+class Sampler:
+    # Samples the stack of one thread at a fixed interval and counts the
+    # collapsed stacks, in the folded format flame graph tools read.
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                             code.co_firstlineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as fp:
+            for stack, count in self.stacks.most_common():
+                fp.write('%s %d\n' % (stack, count))
+
+
+class Middleware:
+    # Times every request from the moment the server hands it over until
+    # the response iterable is closed. Route names come from
+    # environ['focus.route'], which the Flask app sets once routing is done.
+    def __init__(self, wsgi_app, config, video_routes=()):
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self.video_routes = frozenset(video_routes)
+
+    def __call__(self, environ, start_response):
+        if not self.config['METRICS_ENABLED']:
+            return self.wsgi_app(environ, start_response)
+
+        if self.config['METRICS_FOLDER']:
+            start_writer(self.config['METRICS_FOLDER'], self.config['METRICS_FLUSH_INTERVAL'])
+        request = MeteredRequest(self, environ)
+        token = self.config['PROFILE_TOKEN']
+        value = environ.get(PROFILE_ENVIRON_KEY)
+        # WSGI header values are latin-1 decoded; compare_digest only takes
+        # ASCII strings, so compare the raw bytes.
+        if token and value and hmac.compare_digest(value.encode('latin-1'), token.encode('utf-8')):
+            request.start_profile(os.path.join(self.config['PROFILE_FOLDER'], '%d-%d.folded' % (
+                time.time_ns(), os.getpid())))
+
+        def metered_start_response(status, headers, exc_info=None):
+            request.status = status.split(' ', 1)[0]
+            request.headers = headers
+            if request.profile_path:
+                headers = headers + [(PROFILE_HEADER, os.path.basename(request.profile_path))]
+            return start_response(status, headers, exc_info)
+
+        try:
+            result = self.wsgi_app(environ, metered_start_response)
+        except BaseException:
+            request.status = '500'
+            request.finish()
+            raise
+        return request.wrap(result)
+
+
+class MeteredRequest:
+    def __init__(self, middleware, environ):
+        self.middleware = middleware
+        self.environ = environ
+        self.started = time.perf_counter()
+        self.status = None
+        self.headers = []
+        self.sent = 0
+        self.first_byte = None
+        self.sampler = None
+        self.profile_path = None
+        self.streaming = False
+        self.finished = False
+
+    @property
+    def route(self):
+        return self.environ.get('focus.route') or 'unmatched'
+
+    def start_profile(self, path):
+        self.profile_path = path
+        self.sampler = Sampler(threading.get_ident()).start()
+
+    def wrap(self, result):
+        self.streaming = self.route in self.middleware.video_routes
+        if self.streaming:
+            STREAMS_IN_FLIGHT.inc()
+
+        file_wrapper = self.environ.get('wsgi.file_wrapper')
+        if isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+            # The server sends this with sendfile(), so the body never passes
+            # through here. Count its length at hand-off and keep the object
+            # as it is, only hooking close() to end the timing.
+            if self.environ['REQUEST_METHOD'] != 'HEAD':
+                self.sent = int(dict((k.lower(), v) for k, v in self.headers).get('content-length') or 0)
+            self.first_byte = time.perf_counter()
+            close = result.close
+
+            def metered_close():
+                try:
+                    close()
+                finally:
+                    self.finish()
+            result.close = metered_close
+            return result
+        return MeteredResponse(self, result)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        route, method = self.route, self.environ['REQUEST_METHOD']
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started, route, method)
+        REQUESTS.inc(route, method, self.status or '500')
+        if self.sent:
+            SERVED_BYTES.inc(route, amount=self.sent)
+        if self.streaming:
+            STREAMS_IN_FLIGHT.dec()
+            if self.first_byte is not None:
+                VIDEO_TTFB.observe(self.first_byte - self.started, route)
+        if self.sampler is not None:
+            self.sampler.stop()
+            self.sampler.write(self.profile_path)
+
+
+class MeteredResponse:
+    def __init__(self, request, result):
+        self.request = request
+        self.result = result
+
+    def __iter__(self):
+        # Finishing here as well as in close() covers servers that never
+        # call close(), such as asgiref's WsgiToAsgi.
+        request = self.request
+        try:
+            for chunk in self.result:
+                if chunk:
+                    if request.first_byte is None:
+                        request.first_byte = time.perf_counter()
+                    request.sent += len(chunk)
+                yield chunk
+        finally:
+            request.finish()
+
+    def close(self):
+        try:
+            if hasattr(self.result, 'close'):
+                self.result.close()
+        finally:
+            self.request.finish()
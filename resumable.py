@@ -0,0 +1,114 @@
+import fcntl
+import hashlib
+import os
+import secrets
+import time
+
+import metrics
+
+CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    length INTEGER NOT NULL,
+    offset INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL
+);
+'''
+
+# Hash state of the sessions this process has been appending to, so that a
+# resumed upload only has to re-read the partial file when it moves between
+# worker processes.
+_hashers = {}
+
+
+def init(conn):
+    conn.executescript(SCHEMA)
+
+
+def write_stream(stream, fp, hasher, chunk_size=CHUNK_SIZE, on_chunk=None):
+    written = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        started = time.perf_counter()
+        fp.write(chunk)
+        metrics.record_disk_write(len(chunk), time.perf_counter() - started)
+        hasher.update(chunk)
+        written += len(chunk)
+        if on_chunk is not None:
+            on_chunk(len(chunk))
+    return written
+
+
+def lock_partial(fp):
+    # flock() locks belong to the open file, so this excludes other threads
+    # of the process as well as other workers. Released when fp is closed.
+    try:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def partial_path(folder, session_id):
+    return os.path.join(folder, '.%s.part' % session_id)
+
+
+def create_session(conn, user_id, filename, length):
+    session_id = secrets.token_hex(16)
+    with conn:
+        conn.execute(
+            'INSERT INTO upload_sessions (id, user_id, filename, length, offset, created) '
+            'VALUES (?, ?, ?, ?, 0, ?)',
+            (session_id, user_id, filename, length, time.time()))
+    return session_id
+
+
+def get_session(conn, session_id):
+    return conn.execute('SELECT * FROM upload_sessions WHERE id = ?', (session_id,)).fetchone()
+
+
+def set_offset(conn, session_id, offset):
+    with conn:
+        conn.execute('UPDATE upload_sessions SET offset = ? WHERE id = ?', (offset, session_id))
+
+
+def delete_session(conn, session_id):
+    _hashers.pop(session_id, None)
+    with conn:
+        conn.execute('DELETE FROM upload_sessions WHERE id = ?', (session_id,))
+
+
+def expire_sessions(conn, max_age):
+    rows = conn.execute('SELECT * FROM upload_sessions WHERE created < ?',
+                        (time.time() - max_age,)).fetchall()
+    for row in rows:
+        delete_session(conn, row['id'])
+    return rows
+
+
+def take_hasher(session_id, path, offset):
+    cached = _hashers.pop(session_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+
+    hasher = hashlib.sha256()
+    if offset:
+        with open(path, 'rb') as fp:
+            remaining = offset
+            while remaining:
+                chunk = fp.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                hasher.update(chunk)
+                remaining -= len(chunk)
+    return hasher
+
+
+def keep_hasher(session_id, offset, hasher):
+    _hashers[session_id] = (offset, hasher)
@@ -1,18 +1,318 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, abort
+from flask import Flask, render_template, request, redirect, url_for, abort, jsonify, g
+from flask import before_render_template, template_rendered
+import base64
+import contextlib
+import hashlib
+import math
+import mimetypes
 import os
+import re
+import shutil
+import time
+from urllib.parse import quote
+from werkzeug.exceptions import HTTPException, TooManyRequests
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 
+import click
+
+import admission
+import blobs
+import catalog
+import jobs
+import media
+import metrics
+import resumable
+import serving
+
 app = Flask(__name__)
 
 UPLOAD_FOLDER = 'uploads'
+DATA_FOLDER = 'data'
 ALLOWED_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv', 'flv'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['DATA_FOLDER'] = DATA_FOLDER
+app.config['CATALOG_DATABASE'] = os.path.join(DATA_FOLDER, 'catalog.db')
+app.config['BLOB_FOLDER'] = os.path.join(DATA_FOLDER, 'blobs')
+app.config['HLS_FOLDER'] = os.path.join(DATA_FOLDER, 'hls')
+app.config['POSTER_FOLDER'] = os.path.join(DATA_FOLDER, 'posters')
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024
+app.config['STREAM_MAX_CONTENT_LENGTH'] = 4 * 1024 * 1024 * 1024
+app.config['UPLOAD_SESSION_MAX_AGE'] = 24 * 60 * 60
+# None, 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache/lighttpd).
+app.config['VIDEO_OFFLOAD'] = None
+# Internal location mapped to BLOB_FOLDER in the front server.
+app.config['VIDEO_OFFLOAD_PREFIX'] = '/protected-blobs/'
+app.config['BLOB_CACHE_CONTROL'] = 'max-age=31536000, immutable'
+app.config['TRANSCODE_EXTENSIONS'] = {'avi', 'mov', 'wmv', 'flv'}
+# {input}, {output_dir} and {playlist} are substituted in each argument.
+app.config['TRANSCODE_COMMAND'] = [
+    'ffmpeg', '-nostdin', '-y', '-i', '{input}',
+    '-map', '0:v:0', '-map', '0:a:0?', '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac',
+    '-f', 'hls', '-hls_time', '6', '-hls_playlist_type', 'vod',
+    '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+    '-hls_segment_filename', '{output_dir}/segment_%05d.m4s', '{playlist}',
+]
+app.config['TRANSCODE_TIMEOUT'] = 60 * 60
+# {input} and {output} are substituted in each argument.
+app.config['POSTER_COMMAND'] = [
+    'ffmpeg', '-nostdin', '-y', '-ss', '1', '-i', '{input}',
+    '-frames:v', '1', '-vf', 'scale=480:-2', '{output}',
+]
+app.config['THUMBNAIL_CACHE_SIZE'] = 32 * 1024 * 1024
+# Upload admission control, shared by all worker processes through
+# ADMISSION_DATABASE. Rates apply per user and per client IP; set a limit
+# to None to disable it.
+app.config['ADMISSION_DATABASE'] = os.path.join(DATA_FOLDER, 'admission.db')
+# Number of reverse proxies in front of the app whose X-Forwarded-For is
+# trusted. 0 uses the peer address, which behind a proxy is the proxy's.
+app.config['TRUSTED_PROXIES'] = 0
+app.config['UPLOAD_REQUEST_RATE'] = 1.0
+app.config['UPLOAD_REQUEST_BURST'] = 10
+app.config['UPLOAD_BYTE_RATE'] = 50 * 1024 * 1024
+app.config['UPLOAD_BYTE_BURST'] = 100 * 1024 * 1024
+app.config['USER_QUOTA'] = 10 * 1024 * 1024 * 1024
+app.config['MAX_CONCURRENT_UPLOADS'] = 32
+app.config['UPLOAD_SLOT_TTL'] = 60 * 60
+# Prometheus metrics on /metrics. Each worker process writes its counters to
+# METRICS_FOLDER at most every METRICS_FLUSH_INTERVAL seconds so that any of
+# them can report the totals; None keeps them per process.
+app.config['METRICS_ENABLED'] = True
+app.config['METRICS_FOLDER'] = os.path.join(DATA_FOLDER, 'metrics')
+app.config['METRICS_FLUSH_INTERVAL'] = 5
+# Requests sent with 'X-Focus-Profile: <PROFILE_TOKEN>' are sampled and the
+# folded stacks written to PROFILE_FOLDER. None disables the header.
+app.config['PROFILE_TOKEN'] = None
+app.config['PROFILE_FOLDER'] = os.path.join(DATA_FOLDER, 'profiles')
+app.config['PAGE_SIZE'] = 50
+app.config['MAX_PAGE_SIZE'] = 500
+
+VIDEO_ROUTES = ('serve_video', 'serve_blob', 'serve_hls')
+
+def trust_proxies(wsgi_app):
+    fixes = {}
+    def proxied_app(environ, start_response):
+        trusted = app.config['TRUSTED_PROXIES']
+        if not trusted:
+            return wsgi_app(environ, start_response)
+        if trusted not in fixes:
+            fixes[trusted] = ProxyFix(wsgi_app, x_for=trusted)
+        return fixes[trusted](environ, start_response)
+    return proxied_app
+
+app.wsgi_app = metrics.Middleware(trust_proxies(app.wsgi_app), app.config, VIDEO_ROUTES)
+
+def forwarded_ip(remote_addr, forwarded_for=None):
+    # The rule ProxyFix(x_for=TRUSTED_PROXIES) applies, for the ASGI routes
+    # that do not go through the WSGI stack.
+    trusted = app.config['TRUSTED_PROXIES']
+    if trusted and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',')]
+        if len(hops) >= trusted:
+            return hops[-trusted]
+    return remote_addr or ''
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+_catalog_ready = False
+
+def get_catalog():
+    global _catalog_ready
+    if 'catalog' not in g:
+        os.makedirs(os.path.dirname(app.config['CATALOG_DATABASE']) or '.', exist_ok=True)
+        g.catalog = catalog.connect(app.config['CATALOG_DATABASE'])
+        if not _catalog_ready:
+            catalog.init(g.catalog)
+            blobs.init(g.catalog)
+            resumable.init(g.catalog)
+            jobs.init(g.catalog)
+            media.init(g.catalog)
+            _catalog_ready = True
+    return g.catalog
+
+class InsufficientStorage(HTTPException):
+    code = 507
+    description = 'Quota de stockage dépassé'
+
+_admission_ready = False
+
+def get_admission():
+    global _admission_ready
+    if 'admission' not in g:
+        os.makedirs(os.path.dirname(app.config['ADMISSION_DATABASE']) or '.', exist_ok=True)
+        g.admission = catalog.connect(app.config['ADMISSION_DATABASE'])
+        if not _admission_ready:
+            admission.init(g.admission)
+            _admission_ready = True
+    return g.admission
+
+@app.teardown_appcontext
+def close_catalog(exc):
+    for name in ('catalog', 'admission'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.close()
+
+def rate_limit(key):
+    rate = app.config['UPLOAD_REQUEST_RATE']
+    if rate:
+        wait = admission.take(get_admission(), 'requests:' + key, 1, rate, app.config['UPLOAD_REQUEST_BURST'])
+        if wait:
+            raise TooManyRequests(retry_after=math.ceil(wait))
+
+def check_quota(user_id, size, filename=None):
+    # With a filename, size is the length of an upload that will replace
+    # the video of that name, so only the difference counts.
+    quota = app.config['USER_QUOTA']
+    if quota is None:
+        return
+    if filename is not None:
+        video = catalog.get_video(get_catalog(), user_id, filename)
+        size -= video['size'] if video else 0
+    if admission.get_usage(get_admission(), user_id) + size > quota:
+        raise InsufficientStorage()
+
+def admit_upload(ip, user_id=None, filename=None, length=None, limit_rate=True):
+    if limit_rate:
+        rate_limit('ip:' + ip)
+    if user_id:
+        if limit_rate:
+            rate_limit('user:' + user_id)
+        if length:
+            check_quota(user_id, length, filename)
+
+    limit = app.config['MAX_CONCURRENT_UPLOADS']
+    if limit is None:
+        return None
+    slot = admission.acquire_slot(get_admission(), limit, app.config['UPLOAD_SLOT_TTL'])
+    if slot is None:
+        raise TooManyRequests('Trop d\'uploads en cours', retry_after=1)
+    return slot
+
+def release_upload(slot):
+    if slot is not None:
+        admission.release_slot(get_admission(), slot)
+
+def upload_delay(ip, user_id, size):
+    rate = app.config['UPLOAD_BYTE_RATE']
+    if not rate:
+        return 0
+    keys = ['ip:' + ip] + (['user:' + user_id] if user_id else [])
+    return max(admission.take(get_admission(), 'bytes:' + key, size, rate, app.config['UPLOAD_BYTE_BURST'],
+                              debt=True)
+               for key in keys)
+
+def upload_throttle(ip, user_id=None):
+    if not app.config['UPLOAD_BYTE_RATE']:
+        return None
+    def throttle(size):
+        delay = upload_delay(ip, user_id, size)
+        if delay:
+            time.sleep(delay)
+    return throttle
+
+@app.before_request
+def name_route():
+    request.environ['focus.route'] = request.endpoint
+
+@app.before_request
+def admit_request():
+    if request.endpoint in ('upload_video', 'append_upload') or \
+            (request.endpoint == 'index' and request.method == 'POST'):
+        # A tus upload is sent as a series of PATCHes; only its creation
+        # counts against the request rate.
+        view_args = request.view_args or {}
+        filename = secure_filename(view_args['filename']) if 'filename' in view_args else None
+        g.upload_slot = admit_upload(request.remote_addr or '', view_args.get('user_id'), filename,
+                                     request.content_length, limit_rate=request.endpoint != 'append_upload')
+        g.uploading = True
+        metrics.UPLOADS_IN_FLIGHT.inc()
+
+@app.teardown_request
+def release_request(exc):
+    release_upload(g.pop('upload_slot', None))
+    if g.pop('uploading', False):
+        metrics.UPLOADS_IN_FLIGHT.dec()
+
+def start_render(sender, template, context, **extra):
+    g.render_started = time.perf_counter()
+
+def end_render(sender, template, context, **extra):
+    started = g.pop('render_started', None)
+    if started is not None:
+        metrics.TEMPLATE_SECONDS.observe(time.perf_counter() - started, template.name)
+
+before_render_template.connect(start_render, app)
+template_rendered.connect(end_render, app)
+
+def tmp_folder():
+    folder = os.path.join(app.config['BLOB_FOLDER'], blobs.TMP_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def save_stream(stream, on_chunk=None):
+    tmp_path = blobs.tmp_path(app.config['BLOB_FOLDER'])
+    tmp_folder()
+    hasher = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as fp:
+            size = resumable.write_stream(stream, fp, hasher, on_chunk=on_chunk)
+    except Exception:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    metrics.UPLOADED_BYTES.inc(request.endpoint, amount=size)
+    return tmp_path, hasher, size
+
+def register_video(user_id, filename, tmp_path, sha256):
+    size = os.path.getsize(tmp_path)
+    old = catalog.get_video(get_catalog(), user_id, filename)
+    delta = size - (old['size'] if old else 0)
+    try:
+        check_quota(user_id, delta)
+    except InsufficientStorage:
+        os.remove(tmp_path)
+        raise
+    blobs.store(get_catalog(), app.config['BLOB_FOLDER'], tmp_path, sha256, user_id, filename, size)
+    admission.add_usage(get_admission(), user_id, delta)
+
+    if media.get_metadata(get_catalog(), sha256) is None:
+        metadata = media.parse_mp4(blobs.blob_path(app.config['BLOB_FOLDER'], sha256)) or {}
+        media.save_metadata(get_catalog(), sha256, metadata)
+    if not os.path.isfile(media.poster_path(app.config['POSTER_FOLDER'], sha256)):
+        jobs.enqueue(get_catalog(), 'poster', user_id, filename)
+
+    if filename.rsplit('.', 1)[1].lower() in app.config['TRANSCODE_EXTENSIONS'] and \
+            not jobs.is_packaged(app.config['HLS_FOLDER'], sha256):
+        return jobs.enqueue_for_blob(get_catalog(), 'hls', user_id, filename, sha256)
+    return None
+
+def resolve_video(user_id, filename):
+    video = catalog.get_video(get_catalog(), user_id, filename)
+    if video is None or not video['sha256']:
+        return None
+    return video
+
+def focus_allowed(headers):
+    if headers.get('X-Focus') == 'stream_allowed':
+        return True
+    metrics.FOCUS_DENIED.inc()
+    return False
+
+def digest_header(digest):
+    return 'sha-256=' + base64.b64encode(digest).decode('ascii')
+
+def list_page():
+    user_id = request.args.get('user_id') or None
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = request.args.get('limit', app.config['PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+    videos, next_cursor = catalog.list_videos(get_catalog(), user_id, cursor, limit)
+    return user_id, videos, next_cursor
+
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
@@ -30,25 +330,347 @@ def index():
 
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
+            rate_limit('user:' + user_id)
 
-            user_folder = os.path.join(app.config['UPLOAD_FOLDER'], user_id)
-            os.makedirs(user_folder, exist_ok=True) 
-            file_path = os.path.join(user_folder, filename) 
-
-            file.save(file_path) 
+            tmp_path, hasher, size = save_stream(file.stream)
+            register_video(user_id, filename, tmp_path, hasher.hexdigest())
             return redirect(url_for('index'))
 
-    return render_template('index.html', os=os)
+    user_id, videos, next_cursor = list_page()
+    return render_template('index.html', videos=videos, user_id=user_id, next_cursor=next_cursor)
+
+
+@app.route('/api/videos')
+def list_videos():
+    user_id, videos, next_cursor = list_page()
+    return jsonify({
+        'videos': [{
+            'user_id': row['user_id'],
+            'filename': row['filename'],
+            'size': row['size'],
+            'mtime': row['mtime'],
+            'sha256': row['sha256'],
+            'url': url_for('serve_video', user_id=row['user_id'], filename=row['filename']),
+            'blob_url': url_for('serve_blob', sha256=row['sha256'], filename=row['filename']),
+        } for row in videos],
+        'next_cursor': next_cursor,
+    })
 
 
 @app.route('/videos/<user_id>/<filename>')
 def serve_video(user_id, filename): 
-    if 'X-Focus' not in request.headers or request.headers['X-Focus'] != 'stream_allowed':
+    if not focus_allowed(request.headers):
         abort(403)  
 
-    user_folder = os.path.join(app.config['UPLOAD_FOLDER'], user_id) 
-    return send_from_directory(user_folder, filename) 
+    video = resolve_video(user_id, filename)
+    if video is None:
+        abort(404)
+    # The name can be rebound to other content, so caches revalidate; the
+    # ETag is the content hash, which makes that a cheap 304.
+    return send_blob(video['sha256'], filename, 'no-cache')
+
+
+@app.route('/blobs/<sha256>/<filename>')
+def serve_blob(sha256, filename):
+    if not focus_allowed(request.headers):
+        abort(403)
+    if not re.fullmatch('[0-9a-f]{64}', sha256):
+        abort(404)
+    return send_blob(sha256, filename, app.config['BLOB_CACHE_CONTROL'])
+
+
+def send_blob(sha256, filename, cache_control):
+    file_path = blobs.blob_path(app.config['BLOB_FOLDER'], sha256)
+    mimetype = mimetypes.guess_type(filename)[0]
+
+    offload = app.config['VIDEO_OFFLOAD']
+    if offload == 'x-accel-redirect':
+        location = app.config['VIDEO_OFFLOAD_PREFIX'] + quote('%s/%s' % (sha256[:2], sha256[2:]))
+        return serving.offload_response('X-Accel-Redirect', location, mimetype, sha256, cache_control)
+    if offload == 'x-sendfile':
+        if not os.path.isfile(file_path):
+            abort(404)
+        return serving.offload_response('X-Sendfile', os.path.abspath(file_path), mimetype, sha256, cache_control)
+
+    return serving.send_video(request.environ, file_path, mimetype, sha256, cache_control)
+
+
+@app.route('/videos/<user_id>/<filename>', methods=['PUT'])
+def upload_video(user_id, filename):
+    filename = secure_filename(filename)
+    if not allowed_file(filename):
+        abort(400, 'Type de fichier non autorisé')
+
+    request.max_content_length = app.config['STREAM_MAX_CONTENT_LENGTH']
+    tmp_path, hasher, size = save_stream(request.stream, upload_throttle(request.remote_addr or '', user_id))
+
+    app.logger.info('Fichier reçu: %s, %d octets', filename, size)
+    job_id = register_video(user_id, filename, tmp_path, hasher.hexdigest())
+    response = jsonify({'user_id': user_id, 'filename': filename, 'size': size,
+                        'sha256': hasher.hexdigest(), 'job_id': job_id})
+    response.status_code = 201
+    response.headers['Digest'] = digest_header(hasher.digest())
+    return response
+
+
+TUS_VERSION = '1.0.0'
+
+def parse_upload_metadata(value):
+    metadata = {}
+    for pair in value.split(','):
+        key, _, encoded = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(encoded).decode('utf-8')
+            except ValueError:
+                abort(400, 'Upload-Metadata invalide')
+    return metadata
+
+def get_upload_session(session_id):
+    session = resumable.get_session(get_catalog(), session_id)
+    if session is None:
+        abort(404)
+    return session
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    length = request.headers.get('Upload-Length', type=int)
+    if length is None or length < 0:
+        abort(400, 'Upload-Length manquant')
+    if length > app.config['STREAM_MAX_CONTENT_LENGTH']:
+        abort(413)
+
+    metadata = parse_upload_metadata(request.headers.get('Upload-Metadata', ''))
+    user_id = metadata.get('user_id')
+    filename = secure_filename(metadata.get('filename', ''))
+    if not user_id:
+        abort(400, 'ID Utilisateur manquant')
+    if not allowed_file(filename):
+        abort(400, 'Type de fichier non autorisé')
+    rate_limit('ip:' + (request.remote_addr or ''))
+    rate_limit('user:' + user_id)
+    check_quota(user_id, length, filename)
+
+    session_id = resumable.create_session(get_catalog(), user_id, filename, length)
+    open(resumable.partial_path(tmp_folder(), session_id), 'wb').close()
+
+    return '', 201, {
+        'Location': url_for('upload_status', session_id=session_id),
+        'Tus-Resumable': TUS_VERSION,
+    }
+
+@app.route('/uploads/<session_id>', methods=['HEAD'])
+def upload_status(session_id):
+    session = get_upload_session(session_id)
+    return '', 200, {
+        'Upload-Offset': str(session['offset']),
+        'Upload-Length': str(session['length']),
+        'Cache-Control': 'no-store',
+        'Tus-Resumable': TUS_VERSION,
+    }
+
+@app.route('/uploads/<session_id>', methods=['PATCH'])
+def append_upload(session_id):
+    session = get_upload_session(session_id)
+    if request.mimetype != 'application/offset+octet-stream':
+        abort(415)
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None or offset < 0:
+        abort(400, 'Upload-Offset manquant')
+    if offset != session['offset']:
+        abort(409)
+
+    partial_path = resumable.partial_path(tmp_folder(), session_id)
+    try:
+        fp = open(partial_path, 'r+b')
+    except FileNotFoundError:
+        abort(404)
+    with fp:
+        # Another PATCH on this session, typically a client retry while the
+        # first request is still running, must not write the file as well.
+        if not resumable.lock_partial(fp):
+            abort(423)
+        session = get_upload_session(session_id)
+        if offset != session['offset']:
+            abort(409)
+
+        request.max_content_length = session['length'] - offset
+        hasher = resumable.take_hasher(session_id, partial_path, offset)
+        fp.seek(offset)
+        fp.truncate()
+        try:
+            resumable.write_stream(request.stream, fp, hasher,
+                                   on_chunk=upload_throttle(request.remote_addr or '', session['user_id']))
+        finally:
+            fp.flush()
+            offset = fp.tell()
+            resumable.set_offset(get_catalog(), session_id, offset)
+            metrics.UPLOADED_BYTES.inc(request.endpoint, amount=offset - session['offset'])
+
+        headers = {'Upload-Offset': str(offset), 'Tus-Resumable': TUS_VERSION}
+        if offset < session['length']:
+            resumable.keep_hasher(session_id, offset, hasher)
+            return '', 204, headers
+
+        app.logger.info('Fichier reçu: %s, %d octets', session['filename'], offset)
+        try:
+            job_id = register_video(session['user_id'], session['filename'], partial_path, hasher.hexdigest())
+        except InsufficientStorage:
+            resumable.delete_session(get_catalog(), session_id)
+            raise
+        except Exception:
+            # The partial file is still in place, so the client can retry
+            # the last PATCH once the catalog is writable again.
+            resumable.keep_hasher(session_id, offset, hasher)
+            raise
+        resumable.delete_session(get_catalog(), session_id)
+    headers['Digest'] = digest_header(hasher.digest())
+    if job_id is not None:
+        headers['Location'] = url_for('job_status', job_id=job_id)
+    return '', 204, headers
+
+@app.route('/uploads/<session_id>', methods=['DELETE'])
+def cancel_upload(session_id):
+    get_upload_session(session_id)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(resumable.partial_path(tmp_folder(), session_id))
+    resumable.delete_session(get_catalog(), session_id)
+    return '', 204, {'Tus-Resumable': TUS_VERSION}
+
+
+@app.route('/api/videos/<user_id>/<filename>/metadata')
+def video_metadata(user_id, filename):
+    video = resolve_video(user_id, filename)
+    if video is None:
+        abort(404)
+
+    row = media.get_metadata(get_catalog(), video['sha256'])
+    result = {field: row[field] if row else None for field in media.FIELDS}
+    result.update(user_id=user_id, filename=filename, size=video['size'], sha256=video['sha256'])
+    if os.path.isfile(media.poster_path(app.config['POSTER_FOLDER'], video['sha256'])):
+        result['poster_url'] = url_for('serve_poster', user_id=user_id, filename=filename)
+    response = jsonify(result)
+    response.set_etag(video['sha256'] + ('-poster' if 'poster_url' in result else ''))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+thumbnail_cache = media.LRUCache(app.config['THUMBNAIL_CACHE_SIZE'])
+
+@app.route('/posters/<user_id>/<filename>')
+def serve_poster(user_id, filename):
+    if not focus_allowed(request.headers):
+        abort(403)
+    video = resolve_video(user_id, filename)
+    if video is None:
+        abort(404)
+
+    data = thumbnail_cache.get(video['sha256'])
+    if data is None:
+        try:
+            with open(media.poster_path(app.config['POSTER_FOLDER'], video['sha256']), 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            abort(404)
+        thumbnail_cache.put(video['sha256'], data)
+
+    response = app.response_class(data, mimetype='image/jpeg')
+    response.set_etag(video['sha256'])
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    job = jobs.get_job(get_catalog(), job_id)
+    if job is None:
+        abort(404)
+
+    result = {key: job[key] for key in ('id', 'kind', 'status', 'user_id', 'filename', 'error',
+                                        'created', 'started', 'finished')}
+    if job['status'] == 'done' and job['kind'] == 'hls':
+        result['playlist_url'] = url_for('serve_hls', user_id=job['user_id'], filename=job['filename'],
+                                         segment=jobs.PLAYLIST)
+    elif job['status'] == 'done' and job['kind'] == 'poster':
+        result['poster_url'] = url_for('serve_poster', user_id=job['user_id'], filename=job['filename'])
+    return jsonify(result)
+
+
+@app.route('/hls/<user_id>/<filename>/<segment>')
+def serve_hls(user_id, filename, segment):
+    if not focus_allowed(request.headers):
+        abort(403)
+
+    video = resolve_video(user_id, filename)
+    file_path = video and safe_join(jobs.hls_folder(app.config['HLS_FOLDER'], video['sha256']), segment)
+    if file_path is None:
+        abort(404)
+    return serving.send_video(request.environ, file_path)
+
+
+@app.route('/metrics')
+def serve_metrics():
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    body = metrics.REGISTRY.render(metrics.collect(app.config['METRICS_FOLDER']))
+    return body, 200, {'Content-Type': metrics.CONTENT_TYPE, 'Cache-Control': 'no-store'}
+
+
+def expire_uploads():
+    for session in resumable.expire_sessions(get_catalog(), app.config['UPLOAD_SESSION_MAX_AGE']):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(resumable.partial_path(tmp_folder(), session['id']))
+
+def reconcile():
+    expire_uploads()
+    imported = blobs.import_tree(get_catalog(), app.config['BLOB_FOLDER'], app.config['UPLOAD_FOLDER'])
+    if imported:
+        app.logger.info('%d fichiers importés depuis %s', imported, app.config['UPLOAD_FOLDER'])
+    admission.reset_usage(get_admission(), catalog.usage_totals(get_catalog()))
+
+def collect_garbage():
+    expire_uploads()
+    deadline = time.time() - app.config['UPLOAD_SESSION_MAX_AGE']
+    with os.scandir(tmp_folder()) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.stat().st_mtime < deadline:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(entry.path)
+
+    collected = blobs.collect(get_catalog(), app.config['BLOB_FOLDER'])
+    for row in collected:
+        shutil.rmtree(jobs.hls_folder(app.config['HLS_FOLDER'], row['sha256']), ignore_errors=True)
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(media.poster_path(app.config['POSTER_FOLDER'], row['sha256']))
+    media.delete_metadata(get_catalog(), [row['sha256'] for row in collected])
+    return collected
+
+@app.cli.command('rescan')
+def rescan_command():
+    reconcile()
+
+@app.cli.command('gc')
+def gc_command():
+    collected = collect_garbage()
+    click.echo('%d blobs supprimés, %d octets libérés' % (len(collected), sum(row['size'] for row in collected)))
+
+def job_settings():
+    return {
+        'blob_folder': app.config['BLOB_FOLDER'],
+        'hls_folder': app.config['HLS_FOLDER'],
+        'poster_folder': app.config['POSTER_FOLDER'],
+        'transcode_command': app.config['TRANSCODE_COMMAND'],
+        'poster_command': app.config['POSTER_COMMAND'],
+        'timeout': app.config['TRANSCODE_TIMEOUT'],
+    }
+
+@app.cli.command('worker')
+@click.option('--processes', default=os.cpu_count() or 1, show_default=True)
+def worker_command(processes):
+    jobs.run_pool(app.config['CATALOG_DATABASE'], job_settings(), processes)
 
 if __name__ == '__main__':
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    with app.app_context():
+        reconcile()
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
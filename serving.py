@@ -0,0 +1,168 @@
+import mimetypes
+import os
+import secrets
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+from werkzeug.datastructures import EnvironHeaders
+from werkzeug.exceptions import NotFound
+from werkzeug.http import http_date, parse_date, parse_range_header, quote_etag
+from werkzeug.sansio.http import is_resource_modified
+from werkzeug.wrappers import Response
+
+import metrics
+
+CHUNK_SIZE = 256 * 1024
+MAX_RANGES = 16
+
+VideoPlan = namedtuple('VideoPlan', 'status headers fp ranges parts size')
+
+
+def file_etag(st):
+    return '%x-%x' % (st.st_size, st.st_mtime_ns)
+
+
+def resolve_ranges(header, size):
+    rng = parse_range_header(header)
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        elif stop is None or stop > size:
+            stop = size
+        if start < stop:
+            ranges.append((start, stop))
+    return ranges
+
+
+def if_range_matches(value, etag, last_modified):
+    if value is None:
+        return True
+    value = value.strip()
+    if value.startswith('"'):
+        return value == quote_etag(etag)
+    if value.startswith('W/'):
+        return False
+    date = parse_date(value)
+    return date is not None and date == last_modified
+
+
+def iter_ranges(fp, ranges, parts=None, chunk_size=CHUNK_SIZE):
+    try:
+        fd = fp.fileno()
+        for i, (start, stop) in enumerate(ranges):
+            if parts:
+                yield parts[i]
+            while start < stop:
+                started = time.perf_counter()
+                chunk = os.pread(fd, min(chunk_size, stop - start), start)
+                metrics.record_disk_read(len(chunk), time.perf_counter() - started)
+                if not chunk:
+                    return
+                start += len(chunk)
+                yield chunk
+        if parts:
+            yield parts[-1]
+    finally:
+        fp.close()
+
+
+def offload_response(header, location, mimetype=None, etag=None, cache_control=None):
+    mimetype = mimetype or mimetypes.guess_type(location)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    response.headers[header] = location
+    if etag:
+        response.headers['ETag'] = quote_etag(etag)
+    if cache_control:
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def plan_video(method, request_headers, path, mimetype=None, etag=None, cache_control=None):
+    try:
+        fp = open(path, 'rb')
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        raise NotFound()
+
+    st = os.fstat(fp.fileno())
+    size = st.st_size
+    etag = etag or file_etag(st)
+    mimetype = mimetype or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    last_modified = datetime.fromtimestamp(int(st.st_mtime), timezone.utc)
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(last_modified),
+    }
+    if cache_control:
+        headers['Cache-Control'] = cache_control
+
+    if not is_resource_modified(http_if_modified_since=request_headers.get('If-Modified-Since'),
+                                http_if_none_match=request_headers.get('If-None-Match'),
+                                etag=etag, last_modified=last_modified):
+        fp.close()
+        return VideoPlan(304, headers, None, [], None, size)
+
+    ranges = None
+    range_header = request_headers.get('Range')
+    if range_header and if_range_matches(request_headers.get('If-Range'), etag, last_modified):
+        ranges = resolve_ranges(range_header, size)
+
+    if ranges == []:
+        fp.close()
+        headers['Content-Range'] = 'bytes */%d' % size
+        return VideoPlan(416, headers, None, [], None, size)
+
+    parts = None
+    if not ranges:
+        status = 200
+        ranges = [(0, size)]
+        headers['Content-Type'] = mimetype
+    elif len(ranges) == 1:
+        status = 206
+        start, stop = ranges[0]
+        headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, size)
+        headers['Content-Type'] = mimetype
+    else:
+        status = 206
+        boundary = secrets.token_hex(16)
+        parts = [
+            ('\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n'
+             % (boundary, mimetype, start, stop - 1, size)).encode('ascii')
+            for start, stop in ranges
+        ]
+        parts.append(('\r\n--%s--\r\n' % boundary).encode('ascii'))
+        headers['Content-Type'] = 'multipart/byteranges; boundary=%s' % boundary
+
+    length = sum(stop - start for start, stop in ranges)
+    if parts:
+        length += sum(len(part) for part in parts)
+    headers['Content-Length'] = str(length)
+
+    if method == 'HEAD':
+        fp.close()
+        fp = None
+    return VideoPlan(status, headers, fp, ranges, parts, size)
+
+
+def send_video(environ, path, mimetype=None, etag=None, cache_control=None):
+    plan = plan_video(environ['REQUEST_METHOD'], EnvironHeaders(environ), path,
+                      mimetype, etag, cache_control)
+
+    if plan.fp is None:
+        body = []
+    elif plan.parts is None and plan.ranges[0][1] == plan.size and 'wsgi.file_wrapper' in environ:
+        # The server bounds the copy by Content-Length and can use
+        # sendfile(); ranges ending before EOF are read with pread so
+        # servers that ignore Content-Length never overrun them.
+        plan.fp.seek(plan.ranges[0][0])
+        body = environ['wsgi.file_wrapper'](plan.fp, CHUNK_SIZE)
+    else:
+        body = iter_ranges(plan.fp, plan.ranges, plan.parts)
+
+    return Response(body, status=plan.status, headers=plan.headers, direct_passthrough=True)
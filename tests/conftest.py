@@ -0,0 +1,77 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import jobs  # noqa: E402
+import server  # noqa: E402
+
+FOCUS = {'X-Focus': 'stream_allowed'}
+
+# Stub encoder: writes a playlist and one segment into the output folder.
+TRANSCODE_STUB = '''
+import os, sys
+source, output_dir, playlist = sys.argv[1:]
+with open(os.path.join(output_dir, 'segment_00000.m4s'), 'wb') as fp:
+    fp.write(open(source, 'rb').read()[:16])
+with open(playlist, 'w') as fp:
+    fp.write('#EXTM3U\\n#EXTINF:6.0,\\nsegment_00000.m4s\\n#EXT-X-ENDLIST\\n')
+'''
+
+POSTER_STUB = '''
+import sys
+with open(sys.argv[2], 'wb') as fp:
+    fp.write(b'\\xff\\xd8stub poster\\xff\\xd9')
+'''
+
+
+def run_next_job(conn):
+    job = jobs.claim(conn, jobs.worker_name())
+    assert job is not None
+    jobs.HANDLERS[job['kind']](conn, job, server.job_settings())
+    jobs.finish(conn, job['id'])
+    return job
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    app = server.app
+    config = {
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'CATALOG_DATABASE': str(tmp_path / 'data' / 'catalog.db'),
+        'ADMISSION_DATABASE': str(tmp_path / 'data' / 'admission.db'),
+        'BLOB_FOLDER': str(tmp_path / 'data' / 'blobs'),
+        'HLS_FOLDER': str(tmp_path / 'data' / 'hls'),
+        'POSTER_FOLDER': str(tmp_path / 'data' / 'posters'),
+        'PROFILE_FOLDER': str(tmp_path / 'data' / 'profiles'),
+        'METRICS_FOLDER': None,
+        'TRANSCODE_COMMAND': [sys.executable, '-c', TRANSCODE_STUB, '{input}', '{output_dir}', '{playlist}'],
+        'POSTER_COMMAND': [sys.executable, '-c', POSTER_STUB, '{input}', '{output}'],
+        'TRANSCODE_TIMEOUT': 30,
+        'UPLOAD_REQUEST_RATE': None,
+        'UPLOAD_BYTE_RATE': None,
+        'USER_QUOTA': None,
+        'MAX_CONCURRENT_UPLOADS': None,
+        'TRUSTED_PROXIES': 0,
+    }
+    for key, value in config.items():
+        monkeypatch.setitem(app.config, key, value)
+    # Every test gets fresh databases, so the schemas must be created again.
+    monkeypatch.setattr(server, '_catalog_ready', False)
+    monkeypatch.setattr(server, '_admission_ready', False)
+    with app.app_context():
+        server.reconcile()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def catalog_conn(app):
+    with app.app_context():
+        yield server.get_catalog()
@@ -0,0 +1,99 @@
+import base64
+
+import pytest
+
+import admission
+import server
+
+TUS = {'Tus-Resumable': '1.0.0'}
+
+
+@pytest.fixture
+def admission_conn(app):
+    with app.app_context():
+        yield server.get_admission()
+
+
+def test_take_refills_at_rate(admission_conn, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'time', lambda: now[0])
+    assert admission.take(admission_conn, 'k', 2, 1.0, 2) == 0
+    assert admission.take(admission_conn, 'k', 1, 1.0, 2) == 1.0
+    now[0] += 1
+    assert admission.take(admission_conn, 'k', 1, 1.0, 2) == 0
+    now[0] += 100
+    assert admission.take(admission_conn, 'k', 3, 1.0, 2) == 1.0
+
+
+def test_take_with_debt(admission_conn, monkeypatch):
+    monkeypatch.setattr(admission.time, 'time', lambda: 1000.0)
+    assert admission.take(admission_conn, 'bytes', 100, 50.0, 100, debt=True) == 0
+    assert admission.take(admission_conn, 'bytes', 100, 50.0, 100, debt=True) == 2.0
+    assert admission.take(admission_conn, 'bytes', 50, 50.0, 100, debt=True) == 3.0
+
+
+def test_slots(admission_conn):
+    slot = admission.acquire_slot(admission_conn, 1, 3600)
+    assert slot is not None
+    assert admission.acquire_slot(admission_conn, 1, 3600) is None
+    admission.release_slot(admission_conn, slot)
+    assert admission.acquire_slot(admission_conn, 1, 3600) is not None
+
+
+def test_slot_of_dead_process_is_reclaimed(admission_conn):
+    with admission_conn:
+        admission_conn.execute('INSERT INTO slots (id, pid, started) VALUES (?, ?, ?)', ('dead', 999999999, 2e9))
+    assert admission.acquire_slot(admission_conn, 1, 3600) is not None
+
+
+def test_request_rate(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_RATE', 0.01)
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_BURST', 2)
+    assert client.put('/videos/alice/a.mp4', data=b'x').status_code == 201
+    assert client.put('/videos/alice/b.mp4', data=b'x').status_code == 201
+    response = client.put('/videos/alice/c.mp4', data=b'x')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert client.get('/api/videos').status_code == 200
+
+
+def test_tus_patches_are_not_rate_limited(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_RATE', 0.01)
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_BURST', 2)
+    metadata = 'user_id %s,filename %s' % (base64.b64encode(b'alice').decode(), base64.b64encode(b'a.mp4').decode())
+    location = client.post('/uploads', headers=dict(TUS, **{
+        'Upload-Length': '10', 'Upload-Metadata': metadata})).headers['Location']
+    for offset in range(10):
+        response = client.patch(location, data=b'x', headers=dict(TUS, **{
+            'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': str(offset)}))
+        assert response.status_code == 204
+
+
+def test_trusted_proxies(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_RATE', 0.01)
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_BURST', 1)
+    monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 1)
+
+    def put(filename, forwarded_for):
+        return client.put('/videos/%s/%s' % (filename, filename + '.mp4'), data=b'x',
+                          headers={'X-Forwarded-For': forwarded_for}).status_code
+    assert put('a', '203.0.113.1') == 201
+    assert put('b', '203.0.113.2') == 201
+    assert put('c', '203.0.113.1') == 429
+
+    with app.app_context():
+        assert server.forwarded_ip('10.0.0.1', '198.51.100.7, 203.0.113.1') == '203.0.113.1'
+        assert server.forwarded_ip('10.0.0.1', None) == '10.0.0.1'
+        monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 0)
+        assert server.forwarded_ip('10.0.0.1', '203.0.113.1') == '10.0.0.1'
+
+
+def test_quota(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'USER_QUOTA', 5000)
+    assert client.put('/videos/alice/a.mp4', data=b'x' * 3000).status_code == 201
+    assert client.put('/videos/alice/b.mp4', data=b'x' * 3000).status_code == 507
+    # Replacing a.mp4 only adds the difference in size.
+    assert client.put('/videos/alice/a.mp4', data=b'y' * 4000).status_code == 201
+    assert client.put('/videos/bob/b.mp4', data=b'x' * 3000).status_code == 201
+    with app.app_context():
+        assert admission.get_usage(server.get_admission(), 'alice') == 4000
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+
+import pytest
+
+import asgi
+import serving
+from conftest import FOCUS
+
+DATA = bytes(range(256)) * 40
+
+
+class Response:
+    def __init__(self, messages):
+        start = messages[0]
+        assert start['type'] == 'http.response.start'
+        self.status = start['status']
+        self.headers = {key.decode('latin-1'): value.decode('latin-1') for key, value in start['headers']}
+        self.body = b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def call(method, path, headers=None, body=b'', chunks=None, client=('127.0.0.1', 1234), send=None):
+    # Drives asgi.app the way an ASGI server would for a single request.
+    chunks = [body] if chunks is None else chunks
+    messages = [{'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    path, _, query = path.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': method, 'scheme': 'http', 'path': path, 'raw_path': path.encode('ascii'),
+        'query_string': query.encode('ascii'), 'root_path': '',
+        'headers': [(key.lower().encode('latin-1'), value.encode('latin-1'))
+                    for key, value in (headers or {}).items()],
+        'client': client, 'server': ('localhost', 5000),
+    }
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)
+
+    async def default_send(message):
+        sent.append(message)
+
+    asyncio.run(asgi.app(scope, receive, send or default_send))
+    return Response(sent) if sent else None
+
+
+@pytest.fixture
+def video(app):
+    response = call('PUT', '/videos/alice/clip.mp4', {'Content-Length': str(len(DATA))},
+                    chunks=[DATA[:1000], DATA[1000:]])
+    assert response.status == 201
+    return response
+
+
+def test_put(app, video):
+    assert video.headers['content-type'] == 'application/json'
+    assert b'"sha256": "%s"' % hashlib.sha256(DATA).hexdigest().encode('ascii') in video.body
+    response = call('GET', '/videos/alice/clip.mp4', FOCUS)
+    assert response.status == 200
+    assert response.headers['etag'] == '"%s"' % hashlib.sha256(DATA).hexdigest()
+    assert response.body == DATA
+
+
+def test_put_rejects_extension_and_size(app, monkeypatch):
+    assert call('PUT', '/videos/alice/notes.txt', body=b'x').status == 400
+    monkeypatch.setitem(app.config, 'STREAM_MAX_CONTENT_LENGTH', 10)
+    assert call('PUT', '/videos/alice/clip.mp4', {'Content-Length': '20'}, b'x' * 20).status == 413
+    # Without a Content-Length the limit is enforced while reading.
+    assert call('PUT', '/videos/alice/clip.mp4', chunks=[b'x' * 8, b'x' * 8]).status == 413
+    assert call('GET', '/api/videos').body.count(b'clip.mp4') == 0
+
+
+def test_range_and_head(app, video):
+    response = call('GET', '/videos/alice/clip.mp4', dict(FOCUS, Range='bytes=100-199'))
+    assert response.status == 206
+    assert response.headers['content-range'] == 'bytes 100-199/%d' % len(DATA)
+    assert response.body == DATA[100:200]
+
+    response = call('GET', '/videos/alice/clip.mp4', dict(FOCUS, Range='bytes=0-9,20-29'))
+    assert response.status == 206
+    assert response.headers['content-type'].startswith('multipart/byteranges')
+    assert DATA[20:30] in response.body
+
+    response = call('HEAD', '/videos/alice/clip.mp4', FOCUS)
+    assert response.status == 200
+    assert response.headers['content-length'] == str(len(DATA))
+    assert response.body == b''
+
+    etag = response.headers['etag']
+    assert call('GET', '/videos/alice/clip.mp4', dict(FOCUS, **{'If-None-Match': etag})).status == 304
+
+
+def test_forbidden_and_missing(app, video):
+    assert call('GET', '/videos/alice/clip.mp4').status == 403
+    assert call('GET', '/videos/alice/missing.mp4', FOCUS).status == 404
+    assert call('GET', '/blobs/not-a-hash/clip.mp4', FOCUS).status == 404
+    assert call('GET', '/blobs/%s/clip.mp4' % ('0' * 64), FOCUS).status == 404
+    assert call('GET', '/hls/alice/clip.mp4/index.m3u8', FOCUS).status == 404
+
+
+def test_blob_route(app, video):
+    sha256 = hashlib.sha256(DATA).hexdigest()
+    response = call('GET', '/blobs/%s/clip.mp4' % sha256, FOCUS)
+    assert response.status == 200
+    assert response.headers['cache-control'] == app.config['BLOB_CACHE_CONTROL']
+
+
+def test_other_routes_go_to_flask(app, video):
+    response = call('GET', '/api/videos')
+    assert response.status == 200
+    assert b'clip.mp4' in response.body
+
+
+def test_file_is_closed_when_client_is_gone(app, video, monkeypatch):
+    plans = []
+    plan_video = serving.plan_video
+
+    def recording_plan_video(*args):
+        plans.append(plan_video(*args))
+        return plans[-1]
+    monkeypatch.setattr(serving, 'plan_video', recording_plan_video)
+
+    async def send(message):
+        raise OSError('client went away')
+
+    with pytest.raises(OSError):
+        call('GET', '/videos/alice/clip.mp4', FOCUS, send=send)
+    assert plans[0].fp.closed
+
+
+def test_request_rate(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_RATE', 0.01)
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_BURST', 1)
+    assert call('PUT', '/videos/alice/a.mp4', body=b'x').status == 201
+    response = call('PUT', '/videos/alice/b.mp4', body=b'x')
+    assert response.status == 429
+    assert int(response.headers['retry-after']) > 0
+    # The user's own bucket applies whichever address the upload comes from.
+    assert call('PUT', '/videos/alice/b.mp4', body=b'x', client=('127.0.0.2', 1234)).status == 429
+    assert call('PUT', '/videos/bob/b.mp4', body=b'x', client=('127.0.0.3', 1234)).status == 201
+
+
+def test_trusted_proxies(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_RATE', 0.01)
+    monkeypatch.setitem(app.config, 'UPLOAD_REQUEST_BURST', 1)
+    monkeypatch.setitem(app.config, 'TRUSTED_PROXIES', 1)
+
+    def put(user_id, forwarded_for):
+        return call('PUT', '/videos/%s/clip.mp4' % user_id, {'X-Forwarded-For': forwarded_for}, b'x').status
+    assert put('a', '203.0.113.1') == 201
+    assert put('b', '203.0.113.2') == 201
+    assert put('c', '203.0.113.1') == 429
+
+
+def test_quota_and_slots(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'USER_QUOTA', 100)
+    assert call('PUT', '/videos/alice/a.mp4', {'Content-Length': '200'}, b'x' * 200).status == 507
+
+    monkeypatch.setitem(app.config, 'MAX_CONCURRENT_UPLOADS', 0)
+    response = call('PUT', '/videos/alice/a.mp4', body=b'x')
+    assert response.status == 429
+    assert response.headers['retry-after'] == '1'
@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+
+import pytest
+
+from bench import common, suite
+
+
+def result_file(tmp_path, name, results):
+    path = tmp_path / name
+    path.write_text(json.dumps({'meta': {'cpus': 4}, 'results': results}))
+    return str(path)
+
+
+def compare(monkeypatch, tmp_path, base, new, *options):
+    output = str(tmp_path / 'comparison.json')
+    monkeypatch.setattr(sys, 'argv', ['suite', 'compare', result_file(tmp_path, 'base.json', base),
+                                      result_file(tmp_path, 'new.json', new), '--output', output] + list(options))
+    suite.main()
+    with open(output) as fp:
+        return json.load(fp)
+
+
+def results(p50, p99, throughput, files=1000):
+    return {'range_random': {'latency_ms': {'p50': p50, 'p99': p99}, 'throughput_mb_s': throughput,
+                             'requests': 500, 'files': files}}
+
+
+def test_direction():
+    assert suite.direction('upload.latency_ms.p95') == -1
+    assert suite.direction('range_sequential.throughput_mb_s') == 1
+    assert suite.direction('listing.steps.100.api.latency_ms.p50') == -1
+    assert suite.direction('upload.requests') is None
+    assert suite.direction('upload.cpu_seconds') is None
+
+
+def test_flatten():
+    nested = {'a': {'b': 1, 'c': {'d': 2.5}}, 'e': None, 'f': True, 'g': 'text'}
+    assert dict(suite.flatten(nested)) == {'a.b': 1, 'a.c.d': 2.5}
+
+
+def test_compare_flags_regressions(monkeypatch, tmp_path, capsys):
+    comparison = compare(monkeypatch, tmp_path, results(10.0, 40.0, 200.0), results(10.5, 50.0, 150.0, files=9))
+    rows = {row['metric']: row for row in comparison['rows']}
+    assert set(rows) == {'range_random.latency_ms.p50', 'range_random.latency_ms.p99',
+                         'range_random.throughput_mb_s'}
+    assert rows['range_random.latency_ms.p99']['change_pct'] == pytest.approx(25.0)
+    assert rows['range_random.throughput_mb_s']['change_pct'] == pytest.approx(-25.0)
+    assert sorted(comparison['regressions']) == ['range_random.latency_ms.p99', 'range_random.throughput_mb_s']
+    assert not rows['range_random.latency_ms.p50']['regressed']
+    assert 'REGRESSED' in capsys.readouterr().out
+
+
+def test_compare_improvements_are_not_regressions(monkeypatch, tmp_path):
+    comparison = compare(monkeypatch, tmp_path, results(10.0, 40.0, 200.0), results(5.0, 20.0, 400.0))
+    assert comparison['regressions'] == []
+
+
+def test_compare_threshold(monkeypatch, tmp_path):
+    base, new = results(10.0, 40.0, 200.0), results(11.5, 46.0, 200.0)
+    assert compare(monkeypatch, tmp_path, base, new, '--threshold', '20')['regressions'] == []
+    assert len(compare(monkeypatch, tmp_path, base, new, '--threshold', '10')['regressions']) == 2
+
+
+def test_compare_fail(monkeypatch, tmp_path):
+    base, new = results(10.0, 40.0, 200.0), results(20.0, 40.0, 200.0)
+    assert compare(monkeypatch, tmp_path, base, base, '--fail')['regressions'] == []
+    with pytest.raises(SystemExit) as e:
+        compare(monkeypatch, tmp_path, base, new, '--fail')
+    assert e.value.code == 1
+
+
+def test_compare_zero_base(monkeypatch, tmp_path):
+    comparison = compare(monkeypatch, tmp_path, results(0.0, 40.0, 200.0), results(5.0, 40.0, 200.0))
+    assert comparison['rows'][0]['change_pct'] == 0.0
+
+
+def test_scenarios_argument():
+    assert suite.scenarios('upload,listing') == ['upload', 'listing']
+    with pytest.raises(argparse.ArgumentTypeError):
+        suite.scenarios('upload,nope')
+
+
+def test_percentiles():
+    assert common.percentiles(list(range(1, 101))) == {'p50': 51, 'p95': 96, 'p99': 100}
+    assert common.percentiles([]) == {'p50': None, 'p95': None, 'p99': None}
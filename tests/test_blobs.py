@@ -0,0 +1,119 @@
+import os
+import time
+
+import pytest
+
+import blobs
+import server
+from conftest import FOCUS
+
+
+def refcounts(conn):
+    return {row['sha256']: row['refcount'] for row in conn.execute('SELECT sha256, refcount FROM blobs')}
+
+
+def sha_of(client, user_id, filename):
+    for video in client.get('/api/videos?user_id=' + user_id).get_json()['videos']:
+        if video['filename'] == filename:
+            return video['sha256']
+    return None
+
+
+def test_identical_uploads_share_a_blob(app, client, catalog_conn):
+    client.put('/videos/alice/a.mp4', data=b'same bytes')
+    client.put('/videos/bob/b.mp4', data=b'same bytes')
+    sha256 = sha_of(client, 'alice', 'a.mp4')
+    assert sha_of(client, 'bob', 'b.mp4') == sha256
+    assert refcounts(catalog_conn) == {sha256: 2}
+    assert len(os.listdir(os.path.join(app.config['BLOB_FOLDER'], sha256[:2]))) == 1
+
+
+def test_reuploading_the_same_content_keeps_one_reference(client, catalog_conn):
+    client.put('/videos/alice/a.mp4', data=b'same bytes')
+    client.put('/videos/alice/a.mp4', data=b'same bytes')
+    assert list(refcounts(catalog_conn).values()) == [1]
+
+
+def test_overwrite_releases_the_old_blob(app, client, catalog_conn):
+    client.put('/videos/alice/a.mp4', data=b'first version')
+    old = sha_of(client, 'alice', 'a.mp4')
+    client.put('/videos/alice/a.mp4', data=b'second version')
+    new = sha_of(client, 'alice', 'a.mp4')
+    assert refcounts(catalog_conn) == {old: 0, new: 1}
+
+    with app.app_context():
+        collected = server.collect_garbage()
+    assert [row['sha256'] for row in collected] == [old]
+    assert refcounts(catalog_conn) == {new: 1}
+    assert not os.path.exists(blobs.blob_path(app.config['BLOB_FOLDER'], old))
+    assert client.get('/videos/alice/a.mp4', headers=FOCUS).data == b'second version'
+
+
+def test_collect_keeps_referenced_blobs(app, client, catalog_conn):
+    client.put('/videos/alice/a.mp4', data=b'kept')
+    assert blobs.collect(catalog_conn, app.config['BLOB_FOLDER']) == []
+    assert client.get('/videos/alice/a.mp4', headers=FOCUS).data == b'kept'
+
+
+def test_import_tree(app, catalog_conn):
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], 'alice')
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'old.mp4'), 'wb') as fp:
+        fp.write(b'legacy upload')
+    with open(os.path.join(folder, 'copy.mp4'), 'wb') as fp:
+        fp.write(b'legacy upload')
+
+    assert blobs.import_tree(catalog_conn, app.config['BLOB_FOLDER'], app.config['UPLOAD_FOLDER']) == 2
+    assert os.listdir(folder) == []
+    assert list(refcounts(catalog_conn).values()) == [2]
+
+
+def test_failed_import_restores_the_file(app, catalog_conn, monkeypatch):
+    folder = os.path.join(app.config['UPLOAD_FOLDER'], 'alice')
+    os.makedirs(folder)
+    source = os.path.join(folder, 'old.mp4')
+    with open(source, 'wb') as fp:
+        fp.write(b'legacy upload')
+    os.utime(source, (time.time() - 7 * 86400,) * 2)
+
+    moved = []
+
+    def failing_store(conn, folder, tmp, *args):
+        moved.append(os.stat(tmp).st_mtime)
+        raise RuntimeError('database is locked')
+    monkeypatch.setattr(blobs, 'store', failing_store)
+
+    with pytest.raises(RuntimeError):
+        blobs.import_tree(catalog_conn, app.config['BLOB_FOLDER'], app.config['UPLOAD_FOLDER'])
+    assert moved[0] > time.time() - 60
+    with open(source, 'rb') as fp:
+        assert fp.read() == b'legacy upload'
+
+
+def test_blob_route_is_immutable(client):
+    sha256 = client.put('/videos/alice/clip.mp4', data=b'clip').get_json()['sha256']
+    response = client.get('/blobs/%s/clip.mp4' % sha256, headers=FOCUS)
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"%s"' % sha256
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get('/blobs/%s/clip.mp4' % ('0' * 64), headers=FOCUS).status_code == 404
+
+    response = client.get('/videos/alice/clip.mp4', headers=FOCUS)
+    assert response.headers['ETag'] == '"%s"' % sha256
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+
+@pytest.mark.parametrize('offload, header', [('x-accel-redirect', 'X-Accel-Redirect'), ('x-sendfile', 'X-Sendfile')])
+def test_offloaded_responses_keep_caching_headers(app, client, monkeypatch, offload, header):
+    sha256 = client.put('/videos/alice/clip.mp4', data=b'clip').get_json()['sha256']
+    monkeypatch.setitem(app.config, 'VIDEO_OFFLOAD', offload)
+
+    response = client.get('/blobs/%s/clip.mp4' % sha256, headers=FOCUS)
+    assert header in response.headers
+    assert response.headers['ETag'] == '"%s"' % sha256
+    assert response.headers['Cache-Control'] == app.config['BLOB_CACHE_CONTROL']
+
+    response = client.get('/videos/alice/clip.mp4', headers=FOCUS)
+    assert header in response.headers
+    assert response.headers['ETag'] == '"%s"' % sha256
+    assert response.headers['Cache-Control'] == 'no-cache'
@@ -0,0 +1,85 @@
+import catalog
+
+
+def upload(client, user_id, filename, data=b'video'):
+    assert client.put('/videos/%s/%s' % (user_id, filename), data=data).status_code == 201
+
+
+def names(page):
+    return [(video['user_id'], video['filename']) for video in page['videos']]
+
+
+def test_pagination(client):
+    for i in range(5):
+        upload(client, 'alice', 'clip%d.mp4' % i)
+
+    first = client.get('/api/videos?limit=2').get_json()
+    assert names(first) == [('alice', 'clip0.mp4'), ('alice', 'clip1.mp4')]
+    second = client.get('/api/videos?limit=2&cursor=%d' % first['next_cursor']).get_json()
+    assert names(second) == [('alice', 'clip2.mp4'), ('alice', 'clip3.mp4')]
+    last = client.get('/api/videos?limit=2&cursor=%d' % second['next_cursor']).get_json()
+    assert names(last) == [('alice', 'clip4.mp4')]
+    assert last['next_cursor'] is None
+
+
+def test_exact_page_has_no_next_cursor(client):
+    for i in range(2):
+        upload(client, 'alice', 'clip%d.mp4' % i)
+    assert client.get('/api/videos?limit=2').get_json()['next_cursor'] is None
+
+
+def test_page_size_is_clamped(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'MAX_PAGE_SIZE', 3)
+    for i in range(4):
+        upload(client, 'alice', 'clip%d.mp4' % i)
+    assert len(client.get('/api/videos?limit=1000').get_json()['videos']) == 3
+    assert len(client.get('/api/videos?limit=0').get_json()['videos']) == 1
+
+
+def test_user_filter(client):
+    upload(client, 'alice', 'a.mp4')
+    upload(client, 'bob', 'b.mp4')
+    upload(client, 'alice', 'c.mp4')
+
+    page = client.get('/api/videos?user_id=alice&limit=1').get_json()
+    assert names(page) == [('alice', 'a.mp4')]
+    page = client.get('/api/videos?user_id=alice&limit=1&cursor=%d' % page['next_cursor']).get_json()
+    assert names(page) == [('alice', 'c.mp4')]
+    assert page['next_cursor'] is None
+    assert names(client.get('/api/videos?user_id=carol').get_json()) == []
+
+
+def test_overwrite_keeps_position(client):
+    upload(client, 'alice', 'a.mp4')
+    upload(client, 'alice', 'b.mp4')
+    upload(client, 'alice', 'a.mp4', b'new content')
+    videos = client.get('/api/videos').get_json()['videos']
+    assert [video['filename'] for video in videos] == ['a.mp4', 'b.mp4']
+    assert videos[0]['size'] == len(b'new content')
+
+
+def test_index_page(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'PAGE_SIZE', 1)
+    upload(client, 'alice', 'a.mp4')
+    upload(client, 'bob', 'b.mp4')
+
+    html = client.get('/').get_data(as_text=True)
+    assert 'a.mp4' in html
+    assert 'b.mp4' not in html
+    assert 'Page suivante' in html
+
+    html = client.get('/?user_id=bob').get_data(as_text=True)
+    assert 'b.mp4' in html
+    assert 'a.mp4' not in html
+    assert 'value="bob"' in html
+    assert 'Page suivante' not in html
+
+
+def test_scan_skips_hidden_entries(tmp_path):
+    (tmp_path / 'alice').mkdir()
+    (tmp_path / 'alice' / 'clip.mp4').write_bytes(b'12345')
+    (tmp_path / 'alice' / '.partial').write_bytes(b'x')
+    (tmp_path / '.tmp').mkdir()
+    (tmp_path / 'stray.mp4').write_bytes(b'x')
+    assert [entry[:3] for entry in catalog.scan(str(tmp_path))] == [('alice', 'clip.mp4', 5)]
+    assert list(catalog.scan(str(tmp_path / 'missing'))) == []
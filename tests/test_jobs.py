@@ -0,0 +1,124 @@
+import os
+import sqlite3
+
+import pytest
+
+import jobs
+import server
+from conftest import FOCUS, run_next_job
+
+
+def test_transcode_round_trip(client, catalog_conn):
+    response = client.put('/videos/alice/clip.mov', data=b'not really a movie' * 100)
+    assert response.status_code == 201
+    job_id = response.get_json()['job_id']
+    assert client.get('/jobs/%d' % job_id).get_json()['status'] == 'queued'
+
+    kinds = {run_next_job(catalog_conn)['kind'], run_next_job(catalog_conn)['kind']}
+    assert kinds == {'hls', 'poster'}
+    assert jobs.claim(catalog_conn, jobs.worker_name()) is None
+
+    status = client.get('/jobs/%d' % job_id).get_json()
+    assert status['status'] == 'done'
+    assert status['playlist_url'] == '/hls/alice/clip.mov/index.m3u8'
+    assert 'poster_url' not in status
+
+    playlist = client.get(status['playlist_url'], headers=FOCUS)
+    assert playlist.status_code == 200
+    assert b'segment_00000.m4s' in playlist.data
+    segment = client.get('/hls/alice/clip.mov/segment_00000.m4s', headers=FOCUS)
+    assert segment.data == b'not really a movie'[:16]
+    assert client.get(status['playlist_url']).status_code == 403
+
+
+def test_failed_command_marks_job_failed(app, client, catalog_conn, monkeypatch):
+    monkeypatch.setitem(app.config, 'TRANSCODE_COMMAND', ['false'])
+    job_id = client.put('/videos/alice/clip.avi', data=b'x').get_json()['job_id']
+    job = jobs.claim(catalog_conn, jobs.worker_name())
+    while job['id'] != job_id:
+        jobs.finish(catalog_conn, job['id'])
+        job = jobs.claim(catalog_conn, jobs.worker_name())
+
+    try:
+        jobs.transcode(catalog_conn, job, server.job_settings())
+    except RuntimeError as e:
+        jobs.finish(catalog_conn, job['id'], str(e))
+    status = client.get('/jobs/%d' % job_id).get_json()
+    assert status['status'] == 'failed'
+    assert 'playlist_url' not in status
+
+
+def test_requeue_only_dead_local_workers(catalog_conn):
+    host = os.uname().nodename
+    workers = ['%s:%d' % (host, os.getpid()), '%s:999999999' % host, 'elsewhere:1']
+    for worker in workers:
+        jobs.enqueue(catalog_conn, 'hls', 'alice', 'clip.mov')
+        jobs.claim(catalog_conn, worker)
+
+    assert jobs.requeue_running(catalog_conn) == 1
+    rows = catalog_conn.execute('SELECT worker, status FROM jobs ORDER BY id').fetchall()
+    assert [tuple(row) for row in rows] == [
+        (workers[0], 'running'), (None, 'queued'), ('elsewhere:1', 'running')]
+
+
+class Stop(BaseException):
+    pass
+
+
+def test_worker_survives_database_errors(app, catalog_conn, monkeypatch):
+    job_id = jobs.enqueue(catalog_conn, 'unknown', 'alice', 'clip.mov')
+    claims = [sqlite3.OperationalError('database is locked')]
+    finishes = [sqlite3.OperationalError('database is locked')]
+    claim, finish = jobs.claim, jobs.finish
+
+    def flaky_claim(conn, worker):
+        if claims:
+            raise claims.pop()
+        job = claim(conn, worker)
+        if job is None:
+            raise Stop()
+        return job
+
+    def flaky_finish(conn, job_id, error=None):
+        if finishes:
+            raise finishes.pop()
+        finish(conn, job_id, error)
+    monkeypatch.setattr(jobs, 'claim', flaky_claim)
+    monkeypatch.setattr(jobs, 'finish', flaky_finish)
+    monkeypatch.setattr(jobs.time, 'sleep', lambda seconds: None)
+
+    with pytest.raises(Stop):
+        jobs.work(app.config['CATALOG_DATABASE'], server.job_settings(), 0)
+    assert not claims and not finishes
+    job = jobs.get_job(catalog_conn, job_id)
+    assert job['status'] == 'failed'
+    assert 'unknown job kind' in job['error']
+
+
+def test_one_hls_job_per_blob(client, catalog_conn):
+    first = client.put('/videos/alice/clip.mov', data=b'same movie').get_json()['job_id']
+    assert client.put('/videos/bob/copy.mov', data=b'same movie').get_json()['job_id'] is None
+    assert client.put('/videos/carol/other.mov', data=b'other movie').get_json()['job_id'] is not None
+
+    jobs.finish(catalog_conn, first, 'exit status 1')
+    assert client.put('/videos/bob/copy.mov', data=b'same movie').get_json()['job_id'] is not None
+
+
+def test_transcode_keeps_output_packaged_meanwhile(app, client, catalog_conn, monkeypatch):
+    sha256 = client.put('/videos/alice/clip.mov', data=b'movie').get_json()['sha256']
+    output_dir = jobs.hls_folder(app.config['HLS_FOLDER'], sha256)
+    run_command = jobs.run_command
+
+    def racing_run_command(command, timeout, **values):
+        run_command(command, timeout, **values)
+        if 'playlist' in values:
+            # Another job finishes first while this one is encoding.
+            os.makedirs(output_dir)
+            with open(os.path.join(output_dir, jobs.PLAYLIST), 'w') as fp:
+                fp.write('#EXTM3U\n')
+    monkeypatch.setattr(jobs, 'run_command', racing_run_command)
+
+    while run_next_job(catalog_conn)['kind'] != 'hls':
+        pass
+    assert os.listdir(output_dir) == [jobs.PLAYLIST]
+    assert not [name for name in os.listdir(app.config['HLS_FOLDER']) if '.tmp-' in name]
@@ -0,0 +1,108 @@
+import struct
+
+import media
+from conftest import FOCUS, run_next_job
+
+
+def box(kind, *children):
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def full_box(kind, payload, version=0):
+    return box(kind, struct.pack('>I', version << 24) + payload)
+
+
+def track(handler, codec, width=0, height=0):
+    # tkhd v0: ids, duration, layers, volume and matrix, then 16.16 width and height.
+    tkhd = full_box(b'tkhd', b'\0' * 72 + struct.pack('>II', width << 16, height << 16))
+    hdlr = full_box(b'hdlr', b'\0' * 4 + handler + b'\0' * 12)
+    stsd = full_box(b'stsd', struct.pack('>I', 1) + struct.pack('>I4s', 16, codec) + b'\0' * 8)
+    return box(b'trak', tkhd, box(b'mdia', hdlr, box(b'minf', box(b'stbl', stsd))))
+
+
+def mvhd(timescale, duration, version=0):
+    if version == 1:
+        return full_box(b'mvhd', struct.pack('>QQIQ', 0, 0, timescale, duration) + b'\0' * 80, 1)
+    return full_box(b'mvhd', struct.pack('>IIII', 0, 0, timescale, duration) + b'\0' * 80)
+
+
+def write(tmp_path, *boxes):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(box(b'ftyp', b'isom\0\0\0\0') + b''.join(boxes))
+    return str(path)
+
+
+def test_parse_mp4(tmp_path):
+    moov = box(b'moov', mvhd(1000, 10000), track(b'vide', b'avc1', 1920, 1080), track(b'soun', b'mp4a'))
+    path = write(tmp_path, moov, box(b'mdat', b'\0' * 1000))
+    metadata = media.parse_mp4(path)
+    assert metadata['duration'] == 10.0
+    assert (metadata['width'], metadata['height']) == (1920, 1080)
+    assert metadata['video_codec'] == 'avc1'
+    assert metadata['audio_codec'] == 'mp4a'
+    assert metadata['bitrate'] == int((tmp_path / 'clip.mp4').stat().st_size * 8 / 10)
+
+
+def test_parse_mp4_moov_after_mdat(tmp_path):
+    moov = box(b'moov', mvhd(600, 1200, version=1), track(b'vide', b'hvc1', 640, 360))
+    path = write(tmp_path, box(b'mdat', b'\0' * 5000), moov)
+    metadata = media.parse_mp4(path)
+    assert metadata['duration'] == 2.0
+    assert metadata['video_codec'] == 'hvc1'
+    assert metadata.get('audio_codec') is None
+
+
+def test_parse_mp4_without_moov(tmp_path):
+    assert media.parse_mp4(write(tmp_path, box(b'mdat', b'\0' * 100))) is None
+
+
+def test_parse_mp4_truncated_box(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(box(b'ftyp', b'isom') + struct.pack('>I4s', 1 << 20, b'moov') + b'\0' * 32)
+    assert not media.parse_mp4(str(path))
+
+
+def test_metadata_route(client):
+    moov = box(b'moov', mvhd(1000, 4000), track(b'vide', b'avc1', 320, 240))
+    client.put('/videos/alice/clip.mp4', data=box(b'ftyp', b'isom') + moov)
+    metadata = client.get('/api/videos/alice/clip.mp4/metadata').get_json()
+    assert metadata['duration'] == 4.0
+    assert metadata['width'] == 320
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = media.LRUCache(10)
+    cache.put('a', b'aaaa')
+    cache.put('b', b'bbbb')
+    cache.get('a')
+    cache.put('c', b'cccc')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'aaaa'
+    assert cache.get('c') == b'cccc'
+    assert cache.size == 8
+
+    cache.put('big', b'x' * 11)
+    assert cache.get('big') is None
+    assert cache.size == 8
+
+
+def test_poster(client, catalog_conn):
+    client.put('/videos/alice/clip.mp4', data=b'poster test bytes')
+    assert client.get('/posters/alice/clip.mp4', headers=FOCUS).status_code == 404
+    assert 'poster_url' not in client.get('/api/videos/alice/clip.mp4/metadata').get_json()
+
+    job = run_next_job(catalog_conn)
+    assert job['kind'] == 'poster'
+    status = client.get('/jobs/%d' % job['id']).get_json()
+    assert status['poster_url'] == '/posters/alice/clip.mp4'
+    assert 'playlist_url' not in status
+    assert client.get('/api/videos/alice/clip.mp4/metadata').get_json()['poster_url'] == status['poster_url']
+
+    poster = client.get(status['poster_url'], headers=FOCUS)
+    assert poster.status_code == 200
+    assert poster.mimetype == 'image/jpeg'
+    assert poster.data.startswith(b'\xff\xd8')
+    cached = client.get(status['poster_url'], headers=dict(FOCUS, **{'If-None-Match': poster.headers['ETag']}))
+    assert cached.status_code == 304
+    assert client.get(status['poster_url']).status_code == 403
@@ -0,0 +1,59 @@
+import metrics
+from conftest import FOCUS
+
+
+def sample(client, name):
+    for line in client.get('/metrics').get_data(as_text=True).splitlines():
+        if line.startswith(name + ' '):
+            return float(line.split()[1])
+    return 0.0
+
+
+def test_metrics(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', True)
+    denied = sample(client, 'focus_forbidden_total')
+    client.put('/videos/alice/clip.mp4', data=b'x' * 100)
+    response = client.get('/videos/alice/clip.mp4')
+    assert response.status_code == 403
+    response.close()
+    assert sample(client, 'focus_forbidden_total') == denied + 1
+
+    # The response is only finished once the body has been consumed.
+    served = sample(client, 'focus_served_bytes_total{route="serve_video"}')
+    response = client.get('/videos/alice/clip.mp4', headers=FOCUS)
+    assert response.data == b'x' * 100
+    assert sample(client, 'focus_served_bytes_total{route="serve_video"}') == served + 100
+
+    response = client.get('/metrics')
+    assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+    assert 'focus_http_request_duration_seconds_bucket{route="serve_video"' in response.get_data(as_text=True)
+
+
+def test_metrics_disabled(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', False)
+    assert client.get('/metrics').status_code == 404
+
+
+def test_profile_header(app, client, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', True)
+    monkeypatch.setitem(app.config, 'PROFILE_TOKEN', 'secret')
+    response = client.get('/api/videos', headers={'X-Focus-Profile': 'secret'})
+    assert response.status_code == 200
+    response.close()
+    assert (tmp_path / 'data' / 'profiles' / response.headers['X-Focus-Profile']).is_file()
+
+    for value in ('wrong', 'é'):
+        response = client.get('/api/videos', headers={'X-Focus-Profile': value})
+        assert response.status_code == 200
+        assert 'X-Focus-Profile' not in response.headers
+
+
+def test_collect_tolerates_concurrent_cleanup(tmp_path, monkeypatch):
+    snapshot = tmp_path / '999999999.json'
+    snapshot.write_text('{}')
+
+    def removed_by_another_worker(pid):
+        snapshot.unlink()
+        return False
+    monkeypatch.setattr(metrics.processes, 'pid_alive', removed_by_another_worker)
+    assert len(metrics.collect(str(tmp_path))) == 1
@@ -0,0 +1,109 @@
+import pytest
+
+from conftest import FOCUS
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def video(client):
+    response = client.put('/videos/alice/clip.mp4', data=DATA)
+    assert response.status_code == 201
+    return response.get_json()
+
+
+def get(client, **headers):
+    return client.get('/videos/alice/clip.mp4', headers=dict(FOCUS, **headers))
+
+
+def test_requires_focus_header(client, video):
+    assert client.get('/videos/alice/clip.mp4').status_code == 403
+
+
+def test_full_response(client, video):
+    response = get(client)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['ETag']
+    assert response.headers['Last-Modified']
+
+
+def test_single_range(client, video):
+    response = get(client, Range='bytes=100-199')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 100-199/%d' % len(DATA)
+    assert response.data == DATA[100:200]
+
+
+def test_suffix_range(client, video):
+    response = get(client, Range='bytes=-10')
+    assert response.status_code == 206
+    assert response.data == DATA[-10:]
+
+
+def test_multiple_ranges(client, video):
+    response = get(client, Range='bytes=0-9,50-59')
+    assert response.status_code == 206
+    assert response.mimetype == 'multipart/byteranges'
+    boundary = response.mimetype_params['boundary'].encode('ascii')
+    parts = [part for part in response.data.split(b'--' + boundary) if part.strip(b'-\r\n')]
+    assert len(parts) == 2
+    assert b'Content-Range: bytes 0-9/%d' % len(DATA) in parts[0]
+    assert parts[0].endswith(DATA[0:10] + b'\r\n')
+    assert b'Content-Range: bytes 50-59/%d' % len(DATA) in parts[1]
+    assert parts[1].endswith(DATA[50:60] + b'\r\n')
+
+
+def test_unsatisfiable_range(client, video):
+    response = get(client, Range='bytes=%d-' % (len(DATA) + 10))
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == 'bytes */%d' % len(DATA)
+
+
+def test_if_none_match(client, video):
+    etag = get(client).headers['ETag']
+    response = get(client, **{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_if_range(client, video):
+    etag = get(client).headers['ETag']
+    matching = get(client, Range='bytes=0-9', **{'If-Range': etag})
+    assert matching.status_code == 206
+    assert matching.data == DATA[:10]
+
+    stale = get(client, Range='bytes=0-9', **{'If-Range': '"something-else"'})
+    assert stale.status_code == 200
+    assert stale.data == DATA
+
+
+def test_head(client, video):
+    response = client.head('/videos/alice/clip.mp4', headers=FOCUS)
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.data == b''
+
+
+def test_unknown_video(client):
+    assert client.get('/videos/alice/missing.mp4', headers=FOCUS).status_code == 404
+
+
+def test_x_accel_redirect(app, client, video, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIDEO_OFFLOAD', 'x-accel-redirect')
+    response = get(client)
+    sha256 = video['sha256']
+    assert response.headers['X-Accel-Redirect'] == '/protected-blobs/%s/%s' % (sha256[:2], sha256[2:])
+    assert response.mimetype == 'video/mp4'
+    assert response.data == b''
+    assert client.get('/videos/alice/clip.mp4').status_code == 403
+
+
+def test_x_sendfile(app, client, video, monkeypatch):
+    monkeypatch.setitem(app.config, 'VIDEO_OFFLOAD', 'x-sendfile')
+    response = get(client)
+    with open(response.headers['X-Sendfile'], 'rb') as fp:
+        assert fp.read() == DATA
+    assert response.data == b''
+    assert get(client, Range='bytes=0-9').headers['X-Sendfile'] == response.headers['X-Sendfile']
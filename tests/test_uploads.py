@@ -0,0 +1,144 @@
+import base64
+import fcntl
+import hashlib
+import io
+import sqlite3
+
+import blobs
+import resumable
+from conftest import FOCUS
+
+TUS = {'Tus-Resumable': '1.0.0'}
+PATCH = dict(TUS, **{'Content-Type': 'application/offset+octet-stream'})
+DATA = b'0123456789abcdef' * 64
+
+
+def metadata(**values):
+    return ','.join('%s %s' % (key, base64.b64encode(value.encode('utf-8')).decode('ascii'))
+                    for key, value in values.items())
+
+
+def create(client, length=len(DATA), user_id='alice', filename='clip.mp4'):
+    response = client.post('/uploads', headers=dict(TUS, **{
+        'Upload-Length': str(length), 'Upload-Metadata': metadata(user_id=user_id, filename=filename)}))
+    assert response.status_code == 201
+    return response.headers['Location']
+
+
+def patch(client, location, offset, data):
+    return client.patch(location, data=data, headers=dict(PATCH, **{'Upload-Offset': str(offset)}))
+
+
+def test_form_upload(client):
+    response = client.post('/', data={'user_id': 'alice', 'video': (io.BytesIO(DATA), 'clip.mp4')})
+    assert response.status_code == 302
+    assert client.get('/videos/alice/clip.mp4', headers=FOCUS).data == DATA
+    assert b'clip.mp4' in client.get('/').data
+
+
+def test_form_rejects_extension(client):
+    response = client.post('/', data={'user_id': 'alice', 'video': (io.BytesIO(b'x'), 'notes.txt')})
+    assert client.get('/api/videos').get_json()['videos'] == []
+    assert response.status_code == 200
+
+
+def test_put_upload(client):
+    response = client.put('/videos/alice/clip.mp4', data=DATA)
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body['size'] == len(DATA)
+    assert body['sha256'] == hashlib.sha256(DATA).hexdigest()
+    assert response.headers['Digest'] == 'sha-256=' + base64.b64encode(hashlib.sha256(DATA).digest()).decode()
+    assert client.put('/videos/alice/notes.txt', data=b'x').status_code == 400
+
+
+def test_tus_resume(client):
+    location = create(client)
+    head = client.head(location, headers=TUS)
+    assert head.headers['Upload-Offset'] == '0'
+    assert head.headers['Upload-Length'] == str(len(DATA))
+
+    first = patch(client, location, 0, DATA[:300])
+    assert first.status_code == 204
+    assert first.headers['Upload-Offset'] == '300'
+    assert client.head(location, headers=TUS).headers['Upload-Offset'] == '300'
+
+    assert patch(client, location, 0, DATA[:300]).status_code == 409
+
+    last = patch(client, location, 300, DATA[300:])
+    assert last.status_code == 204
+    assert last.headers['Upload-Offset'] == str(len(DATA))
+    assert last.headers['Digest'] == 'sha-256=' + base64.b64encode(hashlib.sha256(DATA).digest()).decode()
+    assert client.head(location, headers=TUS).status_code == 404
+    assert client.get('/videos/alice/clip.mp4', headers=FOCUS).data == DATA
+
+
+def test_tus_resume_after_losing_hash_state(client, monkeypatch):
+    location = create(client)
+    patch(client, location, 0, DATA[:500])
+    # As if the next PATCH landed on another worker process.
+    monkeypatch.setattr(resumable, '_hashers', {})
+    patch(client, location, 500, DATA[500:])
+    video = client.get('/api/videos').get_json()['videos'][0]
+    assert video['sha256'] == hashlib.sha256(DATA).hexdigest()
+
+
+def test_tus_rejects_overlong_patch(client):
+    location = create(client, length=10)
+    assert patch(client, location, 0, b'x' * 20).status_code == 413
+
+
+def test_tus_patch_is_locked(app, client):
+    location = create(client)
+    session_id = location.rsplit('/', 1)[1]
+    with app.app_context():
+        path = resumable.partial_path(app.config['BLOB_FOLDER'] + '/.tmp', session_id)
+    with open(path, 'r+b') as fp:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        assert patch(client, location, 0, DATA).status_code == 423
+    assert patch(client, location, 0, DATA).status_code == 204
+
+
+def test_tus_cancel(client):
+    location = create(client)
+    assert client.delete(location, headers=TUS).status_code == 204
+    assert client.head(location, headers=TUS).status_code == 404
+
+
+def test_tus_requires_metadata(client):
+    response = client.post('/uploads', headers=dict(TUS, **{'Upload-Length': '10'}))
+    assert response.status_code == 400
+
+
+def test_tus_session_survives_failed_registration(client, monkeypatch):
+    location = create(client)
+    store = blobs.store
+    failures = [sqlite3.OperationalError('database is locked')]
+
+    def flaky_store(*args):
+        if failures:
+            raise failures.pop()
+        return store(*args)
+    monkeypatch.setattr(blobs, 'store', flaky_store)
+
+    assert patch(client, location, 0, DATA).status_code == 500
+    assert client.head(location, headers=TUS).headers['Upload-Offset'] == str(len(DATA))
+    retry = patch(client, location, len(DATA), b'')
+    assert retry.status_code == 204
+    assert retry.headers['Digest'] == 'sha-256=' + base64.b64encode(hashlib.sha256(DATA).digest()).decode()
+    assert client.get('/videos/alice/clip.mp4', headers=FOCUS).data == DATA
+    assert client.head(location, headers=TUS).status_code == 404
+
+
+def test_tus_quota_ends_session(app, client, monkeypatch):
+    location = create(client)
+    monkeypatch.setitem(app.config, 'USER_QUOTA', 10)
+    assert patch(client, location, 0, DATA).status_code == 507
+    assert client.head(location, headers=TUS).status_code == 404
+
+
+def test_tus_patch_requires_offset(client):
+    location = create(client)
+    assert client.patch(location, data=b'x', headers=PATCH).status_code == 400
+    assert patch(client, location, 'abc', b'x').status_code == 400
+    assert patch(client, location, -1, b'x').status_code == 400